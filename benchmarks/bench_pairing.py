@@ -0,0 +1,98 @@
+"""
+Compares full-graph pairing against score-window pairing on a synthetic field,
+with each matching backend.
+
+Plays a few rounds in memory (no database) so scores, side bias and rematches
+look like a real event, then pairs the next round every way and reports the
+runtime and total pairing cost of each.
+
+    python benchmarks/bench_pairing.py --players 300 --rounds 4 --window 3
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sass.matching import MATCHERS, BlossomMatcher
+from sass.pairing import PairingContext, build_cost_matrices, match_players
+
+BYE_ID = 0
+
+
+def make_field(n):
+    return [
+        {
+            "id": i + 1,
+            "score": 0,
+            "bias": 0,
+            "is_bye": False,
+            "received_bye": False,
+        }
+        for i in range(n)
+    ]
+
+
+def make_context(field, history):
+    plrs = sorted(field, key=lambda plr: (-plr["score"], random.random()))
+    if len(plrs) % 2 == 1:
+        plrs.append(
+            {"id": BYE_ID, "score": -9, "bias": 0, "is_bye": True, "received_bye": False}
+        )
+    return PairingContext(plrs, history)
+
+
+def play_round(field, history, window):
+    ctx = make_context(field, history)
+    costs = build_cost_matrices(ctx)
+    players = {plr["id"]: plr for plr in field}
+    for pair in match_players(costs, window, BlossomMatcher()):
+        corp_id, runner_id = costs.sides(*pair)
+        if BYE_ID in (corp_id, runner_id):
+            plr = players[corp_id if runner_id == BYE_ID else runner_id]
+            plr["score"] += 3
+            plr["received_bye"] = True
+            continue
+        history.add((corp_id, runner_id))
+        corp_score, runner_score = random.choice([(3, 0), (0, 3), (1, 1)])
+        players[corp_id]["score"] += corp_score
+        players[runner_id]["score"] += runner_score
+        players[corp_id]["bias"] += 1
+        players[runner_id]["bias"] -= 1
+
+
+def timed_pairing(costs, window, matcher):
+    start = time.perf_counter()
+    pairs = match_players(costs, window, matcher)
+    elapsed = time.perf_counter() - start
+    return elapsed, pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=4, help="rounds played before the measured one")
+    parser.add_argument("--window", type=int, default=3, help="score window in match points")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    field = make_field(args.players)
+    history = set()
+    for _ in range(args.rounds):
+        play_round(field, history, args.window)
+
+    costs = build_cost_matrices(make_context(field, history))
+    print(f"{args.players} players, round {args.rounds + 1}")
+    print(f"{'matcher':<10}{'mode':<12}{'seconds':>10}{'pairs':>8}{'total cost':>14}")
+    for name, matcher in MATCHERS.items():
+        for mode, window in [("full", None), (f"window={args.window}", args.window)]:
+            elapsed, pairs = timed_pairing(costs, window, matcher())
+            print(
+                f"{name:<10}{mode:<12}{elapsed:>10.3f}{len(pairs):>8}{costs.total_cost(pairs):>14.2f}"
+            )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Reports every result of a round at once, as players do at the end of a round,
+while readers keep loading the pairings page, and counts lock errors.
+
+Works on a scratch copy of sass/app.db, migrated to the latest schema. Each
+reporter and reader is its own process by default, the way gunicorn workers
+would be, or a thread with --threads.
+
+    python benchmarks/stress_reporting.py --reporters 50 --profile concurrent
+"""
+import argparse
+import multiprocessing
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sass import create_app
+from sass.db_grabber import SQLITE_PROFILES
+
+RESULTS = ["c_win", "r_win", "tie"]
+
+
+def setup(app, reporters):
+    from sass import db_ops, migrations, tournament
+
+    with app.app_context():
+        migrations.migrate()
+        tid = db_ops.create_tournament(f"stress {time.time()}")["id"]
+        for i in range(reporters * 2):
+            db_ops.add_player(tid, f"Player {i}", None, None)
+        db_ops.rnd_one_start(tid)
+        tournament.pair_round(tid, 1)
+        mids = [m["id"] for m in db_ops.get_matches(tid, 1)]
+    return tid, mids
+
+
+def report(app, mid, start, out):
+    client = app.test_client()
+    start.wait()
+    began = time.perf_counter()
+    try:
+        r = client.post(f"/reporting/{mid}", data={"result": RESULTS[mid % 3]})
+        error = None if r.status_code < 400 else f"HTTP {r.status_code}"
+    except Exception as e:
+        error = str(e).splitlines()[0]
+    out.put(("report", time.perf_counter() - began, error))
+
+
+def read(app, tid, start, done, out):
+    client = app.test_client()
+    start.wait()
+    while not done.is_set():
+        began = time.perf_counter()
+        try:
+            r = client.get(f"/{tid}/1")
+            error = None if r.status_code < 400 else f"HTTP {r.status_code}"
+        except Exception as e:
+            error = str(e).splitlines()[0]
+        out.put(("read", time.perf_counter() - began, error))
+
+
+def summary(kind, samples):
+    times = sorted(t for t, _ in samples)
+    errors = [e for _, e in samples if e]
+    locked = sum("locked" in e for e in errors)
+    if not times:
+        return f"{kind:<8}no requests"
+    p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+    return (
+        f"{kind:<8}{len(times):>6} requests  max {times[-1] * 1000:8.1f} ms"
+        f"  p95 {p95 * 1000:8.1f} ms  errors {len(errors)}  locked {locked}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--reporters", type=int, default=50)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--profile", choices=sorted(SQLITE_PROFILES), default="concurrent")
+    parser.add_argument("--threads", action="store_true", help="use threads, not processes")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db_path = os.path.join(workdir, "stress.db")
+    shutil.copy(os.path.join(os.path.dirname(__file__), "..", "sass", "app.db"), db_path)
+    app = create_app(
+        {
+            "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_path,
+            "SQLITE_PROFILE": args.profile,
+            "BACKGROUND_JOBS": False,
+            "TESTING": True,
+        }
+    )
+    tid, mids = setup(app, args.reporters)
+
+    if args.threads:
+        start = threading.Barrier(len(mids) + args.readers)
+        done = threading.Event()
+        out = queue.Queue()
+        worker_class = threading.Thread
+    else:
+        ctx = multiprocessing.get_context("fork")
+        start = ctx.Barrier(len(mids) + args.readers)
+        done = ctx.Event()
+        out = ctx.Queue()
+        worker_class = ctx.Process
+
+    def spawn(target, *target_args):
+        return worker_class(target=target, args=(app, *target_args))
+
+    readers = [spawn(read, tid, start, done, out) for _ in range(args.readers)]
+    reporters = [spawn(report, mid, start, out) for mid in mids]
+    for worker in readers + reporters:
+        worker.start()
+    samples = {"report": [], "read": []}
+    while len(samples["report"]) < len(reporters):
+        kind, elapsed, error = out.get()
+        samples[kind].append((elapsed, error))
+    done.set()
+    for worker in reporters + readers:
+        worker.join()
+    while not out.empty():
+        kind, elapsed, error = out.get()
+        samples[kind].append((elapsed, error))
+
+    with app.app_context():
+        from sass.tournament import all_reported
+
+        complete = all_reported(tid, 1)
+    mode = "threads" if args.threads else "processes"
+    print(f"{len(mids)} reporters, {args.readers} readers, {mode}, profile {args.profile}")
+    print(summary("report", samples["report"]))
+    print(summary("read", samples["read"]))
+    print(f"every result saved: {complete}")
+    shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
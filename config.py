@@ -4,4 +4,72 @@ basedir = basedir = os.path.abspath(os.path.dirname(__file__))
 
 
 class Config:
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "app.db")
+    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "sass", "app.db")
+    # Connection pool for the process wide engine, see sass.db_grabber
+    DATABASE_POOL_SIZE = 5
+    DATABASE_MAX_OVERFLOW = 10
+    DATABASE_POOL_RECYCLE = 1800
+    # Keep each tournament's players and matches in its own SQLite file under
+    # PARTITION_DIR (default instance/tournaments), with SQLALCHEMY_DATABASE_URI
+    # only holding the tournament list. Set on a fresh database.
+    DATABASE_PARTITIONED = False
+    PARTITION_DIR = None
+    # SQLite PRAGMA set, see sass.db_grabber.SQLITE_PROFILES
+    SQLITE_PROFILE = "concurrent"
+    # How often a write retries getting the SQLite lock from another process,
+    # waiting DATABASE_WRITE_BACKOFF seconds and doubling each time
+    DATABASE_WRITE_RETRIES = 5
+    DATABASE_WRITE_BACKOFF = 0.05
+    # Only pair players within this many match points of each other, widening
+    # automatically if someone can't be paired. None pairs over the full graph.
+    PAIRING_SCORE_WINDOW = None
+    # Matching backend for pairing, see sass.matching.MATCHERS
+    PAIRING_MATCHER = "blossom"
+    # Seconds pair_round may spend matching. If the exact matcher isn't done in
+    # time the best greedy + local swap pairing is used. None waits for exact.
+    # Needs a matcher that can be cancelled (blossom), networkx is refused.
+    PAIRING_TIME_BUDGET = None
+    # Count and time the SQL each request, pair_round and close_round runs. Runs
+    # slower than QUERY_SLOW_MS, or repeating one statement QUERY_N_PLUS_ONE_THRESHOLD
+    # times, are logged as warnings. The last few runs are served as JSON at
+    # /debug/queries when QUERY_DEBUG_ENDPOINT is on.
+    QUERY_INSTRUMENTATION = True
+    QUERY_SLOW_MS = 500
+    QUERY_N_PLUS_ONE_THRESHOLD = 10
+    QUERY_DEBUG_ENDPOINT = False
+    # How many of the last runs /debug/queries keeps
+    QUERY_STATS_KEPT = 100
+    # Identity list, reloaded when the file changes. Refresh it from
+    # NetrunnerDB with flask refresh-ids.
+    IDS_PATH = os.path.join(basedir, "ids.json")
+    # Tournaments per page of the home page list
+    HOME_PAGE_SIZE = 50
+    # Cache public page data per tournament data version, see sass.cache
+    PAGE_CACHE = True
+    PAGE_CACHE_SIZE = 256
+    # Serialized closed rounds kept for the NRTM export, see sass.nrtm
+    NRTM_ROUND_CACHE_SIZE = 1024
+    # Per round identity stats tallies kept, see sass.stats
+    STATS_ROUND_CACHE_SIZE = 1024
+    # Cross tournament meta reports kept until a summary changes, see sass.meta
+    META_REPORT_CACHE_SIZE = 256
+    # Render the public standings and pairings pages to STATIC_PUBLISH_DIR
+    # (default instance/published) after every change, gzipped alongside,
+    # for a front proxy to serve. STATIC_SERVE has the app serve them itself.
+    STATIC_PUBLISH = False
+    STATIC_PUBLISH_DIR = None
+    STATIC_SERVE = False
+    # Live page updates over Server-Sent Events, see sass.live. Each worker
+    # checks the watched tournaments for changes every LIVE_POLL_INTERVAL
+    # seconds, and streams send a keep-alive every LIVE_HEARTBEAT seconds.
+    # Every open stream holds a worker thread, so run threaded or async
+    # workers. Streams end after LIVE_STREAM_LIFETIME seconds and the
+    # browser reconnects, so no client holds one for long.
+    LIVE_POLL_INTERVAL = 1.0
+    LIVE_HEARTBEAT = 15
+    LIVE_STREAM_LIFETIME = 300
+    # Run pairing, round closing and static publishing on worker threads instead of in the request
+    BACKGROUND_JOBS = True
+    JOB_WORKERS = 2
+    # Seconds after which a job still queued or running is taken to have died with its worker
+    JOB_TIMEOUT = 900
@@ -1,7 +1,7 @@
 import os
 from config import Config
 from flask import Flask
-from json import load
+from sass import identities
 from flask_sqlalchemy import SQLAlchemy
 
 
@@ -15,11 +15,55 @@ def create_app(test_config=None):
     
     
     app.config.from_object(Config)
+    if test_config is not None:
+        app.config.from_mapping(test_config)
     
+    from . import db_grabber
+
+    db_grabber.init_app(app)
+
     from . import db_ops
 
     db_ops.init_app(app)
 
+    from . import jobs
+
+    jobs.init_app(app)
+
+    from . import instrumentation
+
+    instrumentation.init_app(app)
+
+    from . import cache
+
+    cache.init_app(app)
+
+    from . import nrtm
+
+    nrtm.init_app(app)
+
+    from . import stats
+
+    stats.init_app(app)
+
+    from . import meta
+
+    meta.init_app(app)
+
+    identities.init_app(app)
+
+    from . import publisher
+
+    publisher.init_app(app)
+
+    from . import live
+
+    live.init_app(app)
+
+    from . import roster
+
+    roster.init_app(app)
+
     from . import manager
     from . import docs
     from . import auth
@@ -34,11 +78,7 @@ def create_app(test_config=None):
 
 
 def get_id(id_name):
-    with open("ids.json", "r") as f:
-        ids = load(f)
-        for id in ids:
-            if id["name"] == id_name:
-                return {"name": id["name"], "faction": id["faction"]}
+    return identities.get_catalog().get(id_name)
 
 
 def clean_bias(bias_value):
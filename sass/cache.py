@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+from flask import current_app, make_response, request, session
+from sqlalchemy.sql.expression import text
+from werkzeug.exceptions import abort
+from sass.db_grabber import get_conn, has_conn, partitioned
+from sass.signals import tournament_changed
+
+
+class VersionedCache:
+    """
+    Page data per (kind, tid, rnd, data_version), least recently used first out.
+    Every write to a tournament bumps its data_version in the database, so
+    each worker process misses as soon as anything changed, whichever worker
+    made the change.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def forget(self, tid):
+        with self.lock:
+            for key in [key for key in self.entries if key[1] == tid]:
+                del self.entries[key]
+
+
+def get_cache():
+    return current_app.extensions["page_cache"]
+
+
+def tournament_version(tid):
+    q = (
+        get_conn()
+        .execute(text("SELECT data_version FROM tournament WHERE id = :tid"), {"tid": tid})
+        .fetchone()
+    )
+    if q is None:
+        abort(404, f"Tournament id {tid} does not exist")
+    return q["data_version"]
+
+
+def cached(kind, tid, rnd, build):
+    """
+    build()'s result for the tournament's current data_version, built once per version.
+
+    In partitioned mode the version lives in another database than the data.
+    If this request already read the tournament's partition, that snapshot
+    may predate the version just read, so the result isn't cached.
+    """
+    if not current_app.config.get("PAGE_CACHE", True):
+        return build()
+    fresh = not (partitioned() and has_conn(tid))
+    key = (kind, tid, rnd, tournament_version(tid))
+    value = get_cache().get(key)
+    if value is None:
+        value = build()
+        if fresh:
+            get_cache().put(key, value)
+    return value
+
+
+def versioned_page(tid, rnd, render):
+    """
+    Response for a public page that only depends on the tournament's data,
+    with an ETag of its data_version. A browser refreshing an unchanged page
+    gets a 304 without the page being built.
+    """
+    etag = f"{tid}-{rnd}-{tournament_version(tid)}"
+    if etag in request.if_none_match and not session.get("_flashes"):
+        response = make_response("", 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def forget_tournament(sender, tid, **kwargs):
+    # Other workers' entries just stop being hit, this one can drop them now
+    sender.extensions["page_cache"].forget(tid)
+
+
+def init_app(app):
+    app.extensions["page_cache"] = VersionedCache(app.config.get("PAGE_CACHE_SIZE", 256))
+    tournament_changed.connect(forget_tournament, app)
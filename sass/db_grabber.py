@@ -1,17 +1,346 @@
-from flask import g
-from sqlalchemy.sql.schema import MetaData
-from configparser import ConfigParser
-from sqlalchemy import create_engine
-from sqlalchemy.engine.url import URL
 import os
+import re
+import threading
+import time
+import warnings
+from contextlib import contextmanager, nullcontext
+from flask import current_app, g
+from sqlalchemy.sql.schema import MetaData
+from sqlalchemy import create_engine, event
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.expression import text
+from sass.signals import tournament_changed
+
 metadata = MetaData()
-basedir = basedir = os.path.abspath(os.path.dirname(__file__))
+basedir = os.path.abspath(os.path.dirname(__file__))
+DEFAULT_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "app.db")
+
+# One engine per database URL for the life of the process
+_engines = {}
+# SQLite only allows one writer at a time, so each process queues its own
+# writes on a lock per database instead of having them fight over the file
+_write_locks = {}
+_lock = threading.Lock()
+
+# Tables that live in a tournament's partition rather than the main database
+PARTITION_TABLES = ("player", "match", "standings_snapshot")
+# A query reading or writing rows of those tables
+PARTITION_QUERY = re.compile(
+    r'^\s*(?=(?:SELECT|INSERT|UPDATE|DELETE|WITH)\b).*?\b(?:FROM|JOIN|INTO|UPDATE)\s+"?(?:{})\b'.format(
+        "|".join(PARTITION_TABLES)
+    ),
+    re.IGNORECASE | re.DOTALL,
+)
+
+# PRAGMAs run on every new SQLite connection, picked with the SQLITE_PROFILE setting
+SQLITE_PROFILES = {
+    # SQLite's own behaviour: rollback journal, so readers and the writer block each other
+    "default": {"busy_timeout": 5000},
+    # WAL: readers never wait on the writer and see a consistent snapshot
+    # while it works. synchronous=NORMAL is still crash safe in WAL mode,
+    # it only skips the fsync on every commit.
+    "concurrent": {
+        "journal_mode": "wal",
+        "synchronous": "normal",
+        "busy_timeout": 5000,
+        "mmap_size": 268435456,
+    },
+}
+
+
+def get_db(tid=None):
+    """
+    The process wide engine for the app's database, or with tid, for the
+    database that tournament's players and matches live in. Engines (and their
+    connection pools) are created once per URL, and the schema is reflected
+    into metadata once rather than on every call.
+    """
+    uri = database_uri(tid)
+    engine = _engines.get(uri)
+    if engine is None:
+        if uri != database_uri():
+            get_db()
+            engine = get_engine(uri, current_app.config, setup=create_partition)
+        else:
+            engine = get_engine(
+                uri, current_app.config, setup=guard_catalog if partitioned() else None
+            )
+    if not metadata.tables:
+        # Started against an empty database, pick the tables up once init-db has run
+        reflect(engine)
+    return engine
+
+
+def partitioned():
+    return current_app.config.get("DATABASE_PARTITIONED", False)
+
+
+def partition_dir():
+    path = current_app.config.get("PARTITION_DIR") or os.path.join(
+        current_app.instance_path, "tournaments"
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def database_uri(tid=None):
+    """
+    In partitioned mode each tournament's players, matches and snapshots are
+    kept in their own SQLite file, so one event's writes never wait on
+    another's. The main database is then only the catalog of tournaments.
+    """
+    if tid is None or not partitioned():
+        return current_app.config.get("SQLALCHEMY_DATABASE_URI", DEFAULT_DATABASE_URI)
+    return "sqlite:///" + os.path.join(partition_dir(), f"tournament_{tid}.db")
+
+
+def partition_tids():
+    if not partitioned():
+        return []
+    return sorted(
+        int(name[len("tournament_") : -len(".db")])
+        for name in os.listdir(partition_dir())
+        if name.startswith("tournament_") and name.endswith(".db")
+    )
+
+
+def create_partition(engine):
+    """
+    Creates the per tournament tables (as reflected from the main database,
+    indexes included) in a new partition and marks it as fully migrated.
+    """
+    from sass import migrations
+
+    metadata.create_all(
+        engine,
+        tables=[metadata.tables[name] for name in PARTITION_TABLES if name in metadata.tables],
+    )
+    with engine.begin() as conn:
+        if migrations.current_version(conn) == 0:
+            migrations.stamp(conn)
+
+
+def guard_catalog(engine):
+    """
+    In partitioned mode the main database keeps the per tournament tables
+    only as the template for new partitions, so a query on their rows there
+    means the caller left out the tid. It is refused instead of quietly
+    reading or writing the wrong database.
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def check(conn, cursor, statement, parameters, context, executemany):
+        if PARTITION_QUERY.match(statement):
+            raise RuntimeError(
+                "query on a tournament table without a tid in partitioned mode: " + statement
+            )
+
+
+def get_engine(uri, config, setup=None):
+    with _lock:
+        engine = _engines.get(uri)
+        if engine is None:
+            engine = create_engine(uri, **engine_options(uri, config))
+            if engine.dialect.name == "sqlite":
+                configure_sqlite(engine, config.get("SQLITE_PROFILE", "concurrent"))
+                _write_locks[engine] = threading.Lock()
+            if setup is not None:
+                setup(engine)
+            _engines[uri] = engine
+        return engine
+
+
+def configure_sqlite(engine, profile):
+    """
+    Applies the profile's PRAGMAs and takes transactions over from the sqlite3
+    driver, which otherwise only opens one lazily before the first write.
+    Reads get a plain BEGIN when they can have a snapshot without blocking
+    writers (WAL), and writes a BEGIN IMMEDIATE, so the write lock is taken
+    up front, where busy_timeout and write_begin's retries can wait for it.
+    """
+    pragmas = SQLITE_PROFILES[profile]
+    snapshot_reads = pragmas.get("journal_mode") == "wal"
+
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, record):
+        dbapi_conn.isolation_level = None
+        cursor = dbapi_conn.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def on_begin(conn):
+        if conn.info.get("write"):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+        elif snapshot_reads:
+            conn.exec_driver_sql("BEGIN")
+
+
+def engine_options(uri, config):
+    options = {
+        "pool_size": config.get("DATABASE_POOL_SIZE", 5),
+        "max_overflow": config.get("DATABASE_MAX_OVERFLOW", 10),
+        "pool_recycle": config.get("DATABASE_POOL_RECYCLE", 1800),
+    }
+    if uri.startswith("sqlite"):
+        # SQLAlchemy doesn't pool SQLite files by default. Pooled connections
+        # get handed between request and job threads, which sqlite3 refuses
+        # unless told otherwise.
+        options["poolclass"] = QueuePool
+        options["connect_args"] = {"check_same_thread": False}
+    else:
+        options["pool_pre_ping"] = True
+    return options
+
+
+def reflect(engine):
+    with _lock, warnings.catch_warnings():
+        # ix_tournament_title is on lower(title), which the queries use but
+        # the reflected tables don't need
+        warnings.filterwarnings("ignore", "Skipped unsupported reflection of expression-based index")
+        metadata.clear()
+        metadata.reflect(bind=engine)
+
+
+def dispose_engines():
+    """
+    Drops pooled connections inherited from the parent process without closing
+    them, so a forked worker (gunicorn --preload) opens its own.
+    """
+    for engine in list(_engines.values()):
+        engine.dispose(close=False)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=dispose_engines)
+
+
+def get_conn(tid=None):
+    """
+    The connection for the current request (or job, or CLI command), to the
+    database tid lives in. The first use opens a read transaction, so every
+    query until the next write sees the same snapshot. Released by close_conn
+    when the app context tears down.
+    """
+    uri = database_uri(tid)
+    if "db_conns" not in g:
+        g.db_conns = {}
+        g.db_depth = {}
+        g.db_touched = {}
+    if uri not in g.db_conns:
+        g.db_conns[uri] = get_db(tid).connect()
+        g.db_depth[uri] = 0
+        g.db_touched[uri] = set()
+    conn = g.db_conns[uri]
+    if not conn.in_transaction():
+        conn.begin()
+    return conn
+
+
+@contextmanager
+def transaction(tid=None, changes=True):
+    """
+    Unit of work for writes on the request's connection to tid's database,
+    committed when the outermost block exits and rolled back if it raises.
+    Nested blocks on the same database join the outer one. The read snapshot
+    is ended first so the write starts from the latest data, and on SQLite the
+    process's writes to each database go one at a time.
+
+    Every tournament written to (tid, or marked with touch) gets its
+    data_version bumped, in the same transaction when the tournament list is
+    in the same database, straight after the commit otherwise, and then
+    tournament_changed is sent for it. Writes that don't change any data
+    shown for the tournament, like schema migrations, pass changes=False.
+    """
+    conn = get_conn(tid)
+    uri = database_uri(tid)
+    if g.db_depth[uri] > 0:
+        if tid is not None and changes:
+            g.db_touched[uri].add(tid)
+        g.db_depth[uri] += 1
+        try:
+            yield conn
+        finally:
+            g.db_depth[uri] -= 1
+        return
+    conn.get_transaction().commit()
+    in_catalog = uri == database_uri()
+    with _write_locks.get(conn.engine, nullcontext()):
+        conn, tx = write_begin(uri, tid)
+        g.db_depth[uri] = 1
+        touched = g.db_touched[uri] = {tid} if tid is not None and changes else set()
+        try:
+            yield conn
+            if in_catalog:
+                for changed in touched:
+                    bump_version(conn, changed)
+        except BaseException:
+            tx.rollback()
+            raise
+        else:
+            tx.commit()
+        finally:
+            g.db_depth[uri] = 0
+    if touched and not in_catalog:
+        with transaction() as catalog:
+            for changed in touched:
+                bump_version(catalog, changed)
+    for changed in touched:
+        tournament_changed.send(current_app._get_current_object(), tid=changed)
+
+
+def has_conn(tid=None):
+    return "db_conns" in g and database_uri(tid) in g.db_conns
+
+
+def touch(tid):
+    """
+    Marks tid as changed by the current transaction on the main database, for
+    writes to the tournament row itself
+    """
+    g.db_touched[database_uri()].add(tid)
+
+
+def bump_version(conn, tid):
+    conn.execute(
+        text("UPDATE tournament SET data_version = data_version + 1 WHERE id = :tid"),
+        {"tid": tid},
+    )
+
+
+def write_begin(uri, tid=None):
+    """
+    Begins a write transaction, retrying with exponential backoff while
+    another process holds the database lock.
+    """
+    retries = current_app.config.get("DATABASE_WRITE_RETRIES", 5)
+    backoff = current_app.config.get("DATABASE_WRITE_BACKOFF", 0.05)
+    for attempt in range(retries + 1):
+        conn = g.db_conns[uri]
+        conn.info["write"] = True
+        try:
+            tx = conn.begin()
+        except OperationalError as e:
+            conn.info.pop("write", None)
+            if attempt == retries or "locked" not in str(e.orig):
+                raise
+            # A failed begin leaves the Connection unusable, retry on a fresh one
+            conn.close()
+            g.db_conns[uri] = get_db(tid).connect()
+            time.sleep(backoff * 2 ** attempt)
+            continue
+        conn.info.pop("write", None)
+        return conn, tx
+
+
+def close_conn(exc=None):
+    for conn in g.pop("db_conns", {}).values():
+        conn.close()
 
 
-def get_db():
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "app.db")
-    g.db = create_engine(SQLALCHEMY_DATABASE_URI)
-    # print(g)
-    metadata.reflect(bind=g.db)
-    return g.db
-    # return db
+def init_app(app):
+    app.teardown_appcontext(close_conn)
+    with app.app_context():
+        get_db()
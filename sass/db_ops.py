@@ -4,7 +4,16 @@ from re import T
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
 import os
-from sass.db_grabber import get_db, metadata
+from sass.db_grabber import (
+    get_conn,
+    get_db,
+    metadata,
+    partition_dir,
+    partitioned,
+    reflect,
+    touch,
+    transaction,
+)
 import click
 from flask import current_app, g
 from flask.cli import with_appcontext
@@ -12,15 +21,22 @@ from sqlalchemy.sql.expression import distinct, insert, select, table, text, upd
 from sqlalchemy.sql.schema import MetaData, Table
 from sqlalchemy import func
 import sqlparse
-from sass import db_ops
+from sass import db_ops, migrations
+from sass.standings import update_standings
 from werkzeug.exceptions import abort
 
 
 def init_db():
-    db = get_db()
-    with current_app.open_resource("postgres.sql", "r") as f:
-        for statement in sqlparse.split(f):
-            db.connect().execute(text(statement))
+    if partitioned():
+        for name in os.listdir(partition_dir()):
+            if name.startswith("tournament_"):
+                os.remove(os.path.join(partition_dir(), name))
+    with transaction() as conn:
+        with current_app.open_resource("postgres.sql", "r") as f:
+            for statement in sqlparse.split(f):
+                conn.execute(text(statement))
+        migrations.stamp(conn)
+    reflect(get_db())
 
 
 @click.command("init-db")
@@ -33,16 +49,66 @@ def init_db_command():
 
 def init_app(app):
     app.cli.add_command(init_db_command)
+    migrations.init_app(app)
 
 
-def get_tournaments():
-    return get_db().execute("SELECT * FROM tournament ORDER BY id DESC")
+def tournament_filter(active=None, search=None):
+    """
+    WHERE clauses and parameters for the tournament list. search matches the
+    start of the title ignoring case, as a range on lower(title) so it can use
+    ix_tournament_title.
+    """
+    where = []
+    params = {}
+    if active is not None:
+        where.append("active = :active")
+        params["active"] = active
+    if search:
+        where.append("lower(title) >= :prefix AND lower(title) < :prefix_end")
+        params["prefix"] = search.lower()
+        params["prefix_end"] = search.lower() + "\U0010ffff"
+    return where, params
+
+
+def tournaments_query(before=None, limit=None, active=None, search=None):
+    """
+    The query and parameters for get_tournaments
+    """
+    where, params = tournament_filter(active, search)
+    if before is not None:
+        where.append("id < :before_id")
+        params["before_id"] = before
+    query = "SELECT id, title, active FROM tournament"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    query += " ORDER BY id DESC"
+    if limit is not None:
+        query += " LIMIT :limit"
+        params["limit"] = limit
+    return query, params
+
+
+def get_tournaments(before=None, limit=None, active=None, search=None):
+    """
+    The tournament list newest first, only the columns the list shows. Pages
+    are keyed on id: pass the last id of the previous page as before, so a
+    page costs the same however far back it is.
+    """
+    query, params = tournaments_query(before, limit, active, search)
+    return get_conn().execute(text(query), params).fetchall()
+
+
+def count_tournaments(active=None, search=None):
+    where, params = tournament_filter(active, search)
+    query = "SELECT COUNT(*) AS count FROM tournament"
+    if where:
+        query += " WHERE " + " AND ".join(where)
+    return get_conn().execute(text(query), params).fetchone()["count"]
 
 
 def get_tournament(tid):
-    db = get_db()
     tourney = metadata.tables["tournament"]
-    t = db.execute(select(tourney).where(tourney.c.id == tid)).fetchone()
+    t = get_conn().execute(select(tourney).where(tourney.c.id == tid)).fetchone()
 
     if t is None:
         abort(404, f"Tournament id {tid} does not exist")
@@ -51,16 +117,16 @@ def get_tournament(tid):
 
 
 def create_tournament(title, date=datetime.date.today()):
-    db = get_db()
-    db.execute(
-        text(
-            """
-            INSERT INTO tournament (title, t_date)
-            VALUES (:title, :date)
-            """
-        ),{"title":title, "date":date}
-    )
-    return db.execute(
+    with transaction() as conn:
+        conn.execute(
+            text(
+                """
+                INSERT INTO tournament (title, t_date)
+                VALUES (:title, :date)
+                """
+            ),{"title":title, "date":date}
+        )
+    return get_conn().execute(
         text(
         """
         SELECT * from tournament
@@ -81,9 +147,8 @@ def create_tournament(title, date=datetime.date.today()):
 
 
 def add_player(tid, name, corp_id, runner_id):
-    db = get_db()
     player = metadata.tables["player"]
-    with db.begin() as conn:
+    with transaction(tid) as conn:
         conn.execute(
             insert(player).values(
                 p_name=name, tid=tid, corp_id=corp_id, runner_id=runner_id
@@ -92,92 +157,233 @@ def add_player(tid, name, corp_id, runner_id):
     return name
 
 
-def get_player(pid):
+def add_players(tid, players):
+    """
+    Inserts many (name, corp_id, runner_id) at once, in one transaction
+    """
+    if not players:
+        return 0
+    with transaction(tid) as conn:
+        conn.execute(
+            text(
+                """
+                INSERT INTO player (p_name, tid, corp_id, runner_id)
+                VALUES (:name, :tid, :corp_id, :runner_id)
+                """
+            ),
+            [
+                {"name": name, "tid": tid, "corp_id": corp_id, "runner_id": runner_id}
+                for name, corp_id, runner_id in players
+            ],
+        )
+    return len(players)
+
+
+def get_player(pid, tid=None):
     return (
-        get_db()
+        get_conn(tid)
         .execute(text("SELECT * FROM player WHERE id = :pid"), {"pid": pid})
         .fetchone()
     )
 
 
+ACTIVE_PLAYERS = (
+    "SELECT * FROM player WHERE tid = :tid AND active = true ORDER BY score DESC, sos DESC, esos DESC"
+)
+
+ROUND_MATCHES = """
+    SELECT match.id, match.corp_id, match.runner_id, match.corp_score,
+    match.runner_score, match.match_num,
+    corp_plr.p_name as corp_player, runner_plr.p_name as runner_player
+    FROM match
+    LEFT JOIN player corp_plr
+    ON match.corp_id = corp_plr.id
+    LEFT JOIN player runner_plr
+    ON match.runner_id = runner_plr.id
+    WHERE match.tid = :tid AND match.rnd = :rnd
+    ORDER BY match.match_num
+"""
+
+SNAPSHOT_STANDINGS = """
+    SELECT p.id, p.tid, p.p_name AS name, p.corp_id, p.runner_id,
+    coalesce(s.score, p.score) AS score, coalesce(s.sos, p.sos) AS sos,
+    coalesce(s.esos, p.esos) AS esos, coalesce(s.bias, p.bias) AS bias, p.active,
+    coalesce(s.corp_points, 0) AS corp_points, coalesce(s.runner_points, 0) AS runner_points
+    FROM player p
+    LEFT JOIN standings_snapshot s
+    ON s.pid = p.id AND s.tid = p.tid AND s.rnd = :rnd
+    WHERE p.tid = :tid AND p.is_bye = false
+    ORDER BY s.rank IS NULL, s.rank, p.score DESC, p.sos DESC, p.esos DESC
+"""
+
+LIVE_STANDINGS = text(
+    """
+    SELECT id, tid, name, corp_id, runner_id, score, sos, esos, bias, active,
+    sum(coalesce(corp_points,0)) AS corp_points,
+    sum(coalesce(runner_points,0)) AS runner_points
+    from(
+        select p.id as id, p.tid as tid, p.p_name as name, p.corp_id as corp_id, p.runner_id as runner_id,
+        p.score as score, p.sos as sos, p.esos as esos, p.bias as bias, p.active as active,
+        sum(m.corp_score) AS corp_points, 0 AS runner_points
+        FROM player p
+        LEFT JOIN match m on p.id = m.corp_id
+        WHERE p.tid = :tid and p.is_bye = false
+        group by p.id
+        UNION
+        SELECT p.id as id, p.tid as tid, p.p_name as name, p.corp_id as corp_id, p.runner_id as runner_id,
+        p.score as score, p.sos as sos, p.esos as esos, p.bias as bias, p.active as active,
+        0 AS corp_points, sum(m.runner_score) AS runner_points
+        FROM player p
+        LEFT JOIN match m on p.id = m.runner_id
+        WHERE p.tid = :tid and p.is_bye=false
+        group by p.id
+    ) as t
+    group by t.id, t.name, t.tid, t.corp_id, t.runner_id, t.score, t.sos, t.esos, t.bias, t.active
+    order by t.score DESC, t.sos DESC, t.esos DESC
+    """
+)
+
+
 def get_players(tid):
-    db = get_db()
-    # player = metadata.tables["player"]
-    # return db.execute(
-    #     select(player)
-    #     .where(player.c.tid == tid)
-    #     .where(player.c.is_bye == False)
-    #     .order_by(player.c.score.desc(), player.c.sos.desc(), player.c.esos.desc())
-    # ).fetchall()
-
-    return db.execute(
+    """
+    Between rounds nothing can move the standings, so they're served from the
+    snapshot of the last closed round rather than the aggregate query.
+    Players registered since then are listed after it with their live values.
+    """
+    closed = get_closed_rnd(tid)
+    if closed is None:
+        return get_live_players(tid)
+    return (
+        get_conn(tid)
+        .execute(
+            text(SNAPSHOT_STANDINGS),
+            {"tid": tid, "rnd": closed},
+        )
+        .fetchall()
+    )
+
+
+def get_live_players(tid, conn=None):
+    if conn is None:
+        conn = get_conn(tid)
+    return conn.execute(LIVE_STANDINGS, {"tid": tid}).fetchall()
+
+
+def get_closed_rnd(tid):
+    """
+    The round whose snapshot is the current standings: the last closed round,
+    as long as the next one hasn't been paired yet. None otherwise.
+    """
+    rnd = get_tournament(tid)["current_rnd"]
+    q = (
+        get_conn(tid)
+        .execute(
+            text(
+                """
+                SELECT 1 AS closed
+                WHERE NOT EXISTS (SELECT 1 FROM match m WHERE m.tid = :tid AND m.rnd = :rnd)
+                AND EXISTS (
+                    SELECT 1 FROM standings_snapshot s WHERE s.tid = :tid AND s.rnd = :rnd - 1
+                )
+                """
+            ),
+            {"tid": tid, "rnd": rnd},
+        )
+        .fetchone()
+    )
+    return None if q is None else rnd - 1
+
+
+def get_standings(tid, rnd):
+    """
+    Standings as they were when rnd was closed. Names and IDs are the players' current ones.
+    """
+    return (
+        get_conn(tid)
+        .execute(
+            text(
+                """
+                SELECT p.id, p.tid, p.p_name AS name, p.corp_id, p.runner_id,
+                s.score, s.sos, s.esos, s.bias, p.active, s.corp_points, s.runner_points
+                FROM standings_snapshot s
+                INNER JOIN player p ON p.id = s.pid
+                WHERE s.tid = :tid AND s.rnd = :rnd
+                ORDER BY s.rank
+                """
+            ),
+            {"tid": tid, "rnd": rnd},
+        )
+        .fetchall()
+    )
+
+
+def save_standings_snapshot(conn, tid, rnd):
+    """
+    Saves the standings as of the close of rnd, replacing any earlier snapshot of that round
+    """
+    players = get_live_players(tid, conn)
+    conn.execute(
+        text("DELETE FROM standings_snapshot WHERE tid = :tid AND rnd = :rnd"),
+        {"tid": tid, "rnd": rnd},
+    )
+    if not players:
+        return
+    conn.execute(
         text(
             """
-            SELECT id, tid, name, corp_id, runner_id, score, sos, esos, bias, active,
-            sum(coalesce(corp_points,0)) AS corp_points,
-            sum(coalesce(runner_points,0)) AS runner_points
-            from(
-                select p.id as id, p.tid as tid, p.p_name as name, p.corp_id as corp_id, p.runner_id as runner_id,
-                p.score as score, p.sos as sos, p.esos as esos, p.bias as bias, p.active as active,
-                sum(m.corp_score) AS corp_points, 0 AS runner_points
-                FROM player p
-                LEFT JOIN match m on p.id = m.corp_id
-                WHERE p.tid = :tid and p.is_bye = false
-                group by p.id
-                UNION
-                SELECT p.id as id, p.tid as tid, p.p_name as name, p.corp_id as corp_id, p.runner_id as runner_id,
-                p.score as score, p.sos as sos, p.esos as esos, p.bias as bias, p.active as active,
-                0 AS corp_points, sum(m.runner_score) AS runner_points
-                FROM player p
-                LEFT JOIN match m on p.id = m.runner_id
-                WHERE p.tid = :tid and p.is_bye=false
-                group by p.id
-            ) as t
-            group by t.id, t.name, t.tid, t.corp_id, t.runner_id, t.score, t.sos, t.esos, t.bias, t.active
-            order by t.score DESC, t.sos DESC, t.esos DESC 
+            INSERT INTO standings_snapshot
+            (tid, rnd, rank, pid, score, sos, esos, bias, corp_points, runner_points)
+            VALUES (:tid, :rnd, :rank, :pid, :score, :sos, :esos, :bias, :corp_points, :runner_points)
             """
         ),
-        {"tid": tid},
-    ).fetchall()
+        [
+            {
+                "tid": tid,
+                "rnd": rnd,
+                "rank": i + 1,
+                "pid": plr["id"],
+                "score": plr["score"],
+                "sos": plr["sos"],
+                "esos": plr["esos"],
+                "bias": plr["bias"],
+                "corp_points": plr["corp_points"],
+                "runner_points": plr["runner_points"],
+            }
+            for i, plr in enumerate(players)
+        ],
+    )
 
 
 def get_active_players(tid):
     return (
-        get_db()
-        .execute(
-            text(
-                "SELECT * FROM player WHERE tid = :tid AND active = true ORDER BY score DESC, sos DESC, esos DESC"
-            ),
-            {"tid": tid},
-        )
+        get_conn(tid)
+        .execute(text(ACTIVE_PLAYERS), {"tid": tid})
         .fetchall()
     )
 
 
-def db_drop_player(pid):
-    with get_db().begin() as conn:
+def db_drop_player(pid, tid=None):
+    with transaction(tid) as conn:
         conn.execute(
             text("UPDATE player SET active = false WHERE id = :pid"), {"pid": pid}
         )
 
 
-def db_undrop_player(pid):
-    with get_db().begin() as conn:
+def db_undrop_player(pid, tid=None):
+    with transaction(tid) as conn:
         conn.execute(
             text("UPDATE player SET active = true WHERE id = :pid"), {"pid": pid}
         )
 
 
-def remove_player(pid):
-    db = get_db()
-    with db.begin() as conn:
+def remove_player(pid, tid=None):
+    with transaction(tid) as conn:
         conn.execute(text("DELETE FROM player WHERE id = :pid"), {"pid": pid})
 
 
-def update_player(pid, name, corp_id, runner_id):
-    db = get_db()
+def update_player(pid, name, corp_id, runner_id, tid=None):
     plr = metadata.tables["player"]
-    with db.begin() as conn:
+    with transaction(tid) as conn:
         conn.execute(
             update(plr)
             .where(plr.c.id == pid)
@@ -191,21 +397,9 @@ def get_matches(tid, rnd):
     round: Round to get matches from
     """
     return (
-        get_db()
-        .connect()
+        get_conn(tid)
         .execute(
-            text(
-                """SELECT match.id, match.corp_id, match.runner_id, match.corp_score,
-            match.runner_score, match.match_num,
-            corp_plr.p_name as corp_player, runner_plr.p_name as runner_player
-            FROM match
-            LEFT JOIN player corp_plr
-            ON match.corp_id = corp_plr.id
-            LEFT JOIN player runner_plr
-            ON match.runner_id = runner_plr.id
-            WHERE match.tid = :tid AND match.rnd = :rnd
-            ORDER BY match.match_num"""
-            ),
+            text(ROUND_MATCHES),
             {
                 "tid": tid,
                 "rnd": rnd,
@@ -215,16 +409,14 @@ def get_matches(tid, rnd):
     )
 
 
-def get_match(mid):
-    db = get_db()
+def get_match(mid, tid=None):
     match = metadata.tables["match"]
-    return db.connect().execute(select(match).where(match.c.id == mid)).fetchone()
+    return get_conn(tid).execute(select(match).where(match.c.id == mid)).fetchone()
 
 
 def get_rnd_list(tid):
     return (
-        get_db()
-        .connect()
+        get_conn(tid)
         .execute(
             text("SELECT DISTINCT(rnd) as rnds FROM match WHERE tid=:tid ORDER BY rnd"),
             {"tid": tid},
@@ -233,25 +425,20 @@ def get_rnd_list(tid):
     )
 
 
-def get_last_rnd(tid):
-    q = (
-        get_db()
-        .connect()
-        .execute(text("SELECT MAX(rnd) as rnd FROM match WHERE tid=:tid"), {"tid": tid})
-        .fetchone()
-    )
-    return q["rnd"]
-
-
 def rnd_one_start(tid):
-    with get_db().begin() as conn:
+    with transaction() as conn:
         tourn = metadata.tables["tournament"]
         conn.execute(update(tourn).where(tourn.c.id == tid).values(current_rnd=1))
+        touch(tid)
 
 
 def delete_pairings(tid, rnd):
-    db = get_db()
-    with db.begin() as conn:
+    """
+    Results reported in the deleted round have already moved the live
+    standings, so they're recomputed from scratch from the matches that are left.
+    Snapshots from that round on no longer match any pairings and are dropped.
+    """
+    with transaction(tid) as conn:
         conn.execute(
             text("DELETE FROM match WHERE tid=:tid AND rnd = :rnd"),
             {"tid": tid, "rnd": rnd},
@@ -260,85 +447,50 @@ def delete_pairings(tid, rnd):
             text("UPDATE player SET active = false WHERE is_bye = true AND tid = :tid"),
             {"tid": tid},
         )
+        conn.execute(
+            text("DELETE FROM standings_snapshot WHERE tid=:tid AND rnd >= :rnd"),
+            {"tid": tid, "rnd": rnd},
+        )
+        update_standings(conn, tid, reset=True)
 
 
 def switch_tournament_activity(tid):
-    db = get_db()
     tourn = metadata.tables["tournament"]
-    with db.begin() as conn:
+    with transaction() as conn:
         t = conn.execute(select(tourn).where(tourn.c.id == tid)).fetchone()
         if t.active:
             setto = False
         else:
             setto = True
         conn.execute(update(tourn).where(tourn.c.id == tid).values(active=setto))
-
-
-def get_json(tid):
-    t = get_tournament(tid)
-    p = get_players(tid)
-    t_json = {
-        "name": t["title"],
-        "cutToTop": 0,
-        "preliminaryRounds": get_last_rnd(tid),
-        "players": [],
-        "rounds": [],
-        "uploadedFrom": "AesopsTables",
-        "links": [
-            {
-                "rel": "schemaderivedfrom",
-                "href": "http://steffens.org/nrtm/nrtm-schema.json",
-            },
-            {"rel": "uploadedfrom", "href": "https://github.com/Chemscribbler/sass"},
-        ],
-    }
-    for i, player in enumerate(p):
-        t_json["players"].append(
-            {
-                "id": player["id"],
-                "name": player["name"],
-                "rank": i + 1,
-                "corpIdentity": player["corp_id"],
-                "runnerIdentity": player["runner_id"],
-                "matchPoints": player["score"],
-                "strengthOfSchedule": player["sos"],
-                "extendedStrengthOfSchedule": player["esos"],
-                "sideBalance": player["bias"],
-            }
-        )
-    for i in range(get_last_rnd(tid)):
-        matches = []
-        for match in get_matches(tid, i + 1):
-            matches.append(
-                {
-                    "table": match["match_num"],
-                    "corp": {"id": match["corp_id"], "score": match["corp_score"]},
-                    "runner": {
-                        "id": match["runner_id"],
-                        "score": match["runner_score"],
-                    },
-                }
-            )
-        t_json["rounds"].append(matches)
-
-    return t_json
+        touch(tid)
 
 
 def get_stats(tid):
-    db = get_db()
-    with db.begin() as conn:
-        match_table = conn.execute(
+    """
+    Reported results between real players (no byes), counted per round and
+    corp identity against runner identity, in one aggregate query
+    """
+    return (
+        get_conn(tid)
+        .execute(
             text(
-                """select match.id, match.corp_id, match.runner_id, match.corp_score, match.runner_score,
-                corp_plr.p_name, corp_plr.corp_id, corp_plr.is_bye,
-                runner_plr.p_name, runner_plr.runner_id, runner_plr.is_bye
+                """
+                SELECT match.rnd AS rnd, corp_plr.corp_id AS corp_identity,
+                runner_plr.runner_id AS runner_identity, COUNT(*) AS games,
+                SUM(CASE WHEN match.corp_score > match.runner_score THEN 1 ELSE 0 END) AS corp_wins,
+                SUM(CASE WHEN match.corp_score < match.runner_score THEN 1 ELSE 0 END) AS runner_wins,
+                SUM(CASE WHEN match.corp_score = match.runner_score THEN 1 ELSE 0 END) AS ties
                 FROM match
-                LEFT join player corp_plr
-                ON match.corp_id = corp_plr.id
-                LEFT JOIN player runner_plr
-                ON match.runner_id = runner_plr.id
-                WHERE corp_plr.is_bye = false AND runner_plr.is_bye = false AND match.tid = :tid""",
-                {"tid": tid},
-            ).fetchall()
+                INNER JOIN player corp_plr ON match.corp_id = corp_plr.id
+                INNER JOIN player runner_plr ON match.runner_id = runner_plr.id
+                WHERE match.tid = :tid AND match.corp_score IS NOT NULL
+                AND corp_plr.is_bye = false AND runner_plr.is_bye = false
+                GROUP BY match.rnd, corp_plr.corp_id, runner_plr.runner_id
+                ORDER BY match.rnd, corp_plr.corp_id, runner_plr.runner_id
+                """
+            ),
+            {"tid": tid},
         )
-    return match_table
+        .fetchall()
+    )
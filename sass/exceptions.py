@@ -6,5 +6,9 @@ class PairingException(TournamentException):
     pass
 
 
+class PairingTimeout(PairingException):
+    pass
+
+
 class AdminException(TournamentException):
-    pass
\ No newline at end of file
+    pass
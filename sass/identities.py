@@ -0,0 +1,130 @@
+import os
+import tempfile
+import threading
+import time
+from json import dump, load
+import click
+import requests
+from flask import current_app
+from flask.cli import with_appcontext
+
+NETRUNNERDB_CARDS = "https://netrunnerdb.com/api/2.0/public/cards"
+
+
+class IdentityCatalog:
+    """
+    The identities in ids.json, loaded once and indexed by name, with the
+    corp and runner option lists already sorted. The file is checked for
+    changes at most every check_interval seconds and reloaded if its mtime
+    moved. Fetching a new snapshot from NetrunnerDB is never done inside a
+    request, see refresh.
+    """
+
+    def __init__(self, path, check_interval=5):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.mtime = None
+        self.checked = 0
+        self.ids = []
+        self.by_name = {}
+        self.by_key = {}
+        self.options = {"corps": [], "runners": []}
+
+    def current(self):
+        now = time.monotonic()
+        if now - self.checked < self.check_interval:
+            return self
+        with self.lock:
+            self.checked = now
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                return self
+            if mtime != self.mtime:
+                with open(self.path, "r") as f:
+                    self.index(load(f))
+                self.mtime = mtime
+        return self
+
+    def index(self, ids):
+        by_name = {card["name"]: card for card in ids}
+        self.by_key = {" ".join(name.split()).casefold(): card for name, card in by_name.items()}
+        self.options = {
+            "corps": sorted(name for name, card in by_name.items() if card["side"] == "corp"),
+            "runners": sorted(name for name, card in by_name.items() if card["side"] == "runner"),
+        }
+        self.by_name = by_name
+        self.ids = ids
+
+    def get(self, name):
+        card = self.current().by_name.get(name)
+        if card is None:
+            return None
+        return {"name": card["name"], "faction": card["faction"]}
+
+    def lookup(self, name):
+        """
+        The full entry (side included) for a name typed by hand, ignoring case and stray spaces
+        """
+        return self.current().by_key.get(" ".join(name.split()).casefold())
+
+    def all(self):
+        return self.current().ids
+
+    def sorted_options(self):
+        return self.current().options
+
+    def refresh(self):
+        """
+        Downloads the identities from NetrunnerDB and replaces the file in one
+        rename, so readers never see it half written
+        """
+        all_cards = requests.get(NETRUNNERDB_CARDS, timeout=30)
+        all_cards.raise_for_status()
+        ids = [
+            {
+                "side": card["side_code"],
+                "faction": card["faction_code"],
+                "name": card["title"],
+            }
+            for card in all_cards.json()["data"]
+            if card["type_code"] == "identity"
+        ]
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or ".", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            dump(ids, f)
+        os.replace(tmp, self.path)
+        with self.lock:
+            self.checked = 0
+        return len(ids)
+
+    def refresh_in_background(self, logger):
+        def run():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning(f"could not fetch identities from NetrunnerDB: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+
+def get_catalog():
+    return current_app.extensions["identities"]
+
+
+@click.command("refresh-ids")
+@with_appcontext
+def refresh_ids_command():
+    """Download the identity list from NetrunnerDB into ids.json."""
+    count = get_catalog().refresh()
+    click.echo(f"saved {count} identities to {get_catalog().path}")
+
+
+def init_app(app):
+    catalog = IdentityCatalog(app.config.get("IDS_PATH", "ids.json"))
+    app.extensions["identities"] = catalog
+    app.cli.add_command(refresh_ids_command)
+    if not os.path.exists(catalog.path) and app.config.get("BACKGROUND_JOBS", True):
+        # A fresh install without a snapshot, fetch one without holding up startup
+        catalog.refresh_in_background(app.logger)
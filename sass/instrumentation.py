@@ -0,0 +1,178 @@
+import json
+import re
+import threading
+import time
+from collections import Counter, deque
+from functools import wraps
+from flask import Blueprint, abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+bp = Blueprint("instrumentation", __name__)
+
+# Collectors for the current thread, innermost last. A request or an
+# instrumented call pushes one; every query counts towards all of them.
+_local = threading.local()
+_installed = False
+
+
+class QueryStats:
+    """
+    Queries run during one request or one instrumented call: how many, how
+    long they took in total, the slowest ones, and how often each statement
+    shape repeated. A shape repeated many times is usually a query in a loop.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.seconds = 0.0
+        self.shapes = Counter()
+        self.slowest = []
+        self.started = time.time()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.shapes[statement_shape(statement)] += 1
+        self.slowest.append((seconds, statement))
+        if len(self.slowest) > 20:
+            self.slowest.sort(reverse=True)
+            del self.slowest[5:]
+
+    def n_plus_one(self, threshold):
+        return [
+            {"statement": shape, "count": n}
+            for shape, n in self.shapes.most_common()
+            if n >= threshold
+        ]
+
+    def to_dict(self, threshold=10):
+        return {
+            "name": self.name,
+            "started": self.started,
+            "queries": self.count,
+            "time_ms": round(self.seconds * 1000, 2),
+            "slowest": [
+                {"statement": " ".join(statement.split()), "ms": round(seconds * 1000, 2)}
+                for seconds, statement in sorted(self.slowest, reverse=True)[:5]
+            ],
+            "n_plus_one": self.n_plus_one(threshold),
+        }
+
+
+def statement_shape(statement):
+    """
+    Normalizes a statement so the same query with different literals counts as one shape
+    """
+    shape = " ".join(statement.split())
+    shape = re.sub(r"'(?:[^']|'')*'", "?", shape)
+    shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", shape)
+    shape = re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?)", shape)
+    return shape
+
+
+def collectors():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if collectors():
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = collectors()
+    if not stack or not conn.info.get("query_started"):
+        return
+    seconds = time.perf_counter() - conn.info["query_started"].pop()
+    for stats in stack:
+        stats.record(statement, seconds)
+
+
+def start(name):
+    stats = QueryStats(name)
+    collectors().append(stats)
+    return stats
+
+
+def finish(stats):
+    """
+    Pops stats off the thread's collectors, logs it and keeps it for the debug endpoint
+    """
+    stack = collectors()
+    if stats in stack:
+        stack.remove(stats)
+    config = current_app.config
+    summary = stats.to_dict(config.get("QUERY_N_PLUS_ONE_THRESHOLD", 10))
+    current_app.extensions["query_stats"].append(summary)
+    if summary["n_plus_one"] or summary["time_ms"] >= config.get("QUERY_SLOW_MS", 500):
+        current_app.logger.warning(f"query stats {json.dumps(summary)}")
+    else:
+        current_app.logger.debug(f"query stats {json.dumps(summary)}")
+    return summary
+
+
+def instrumented(name):
+    """
+    Decorator that collects the queries of each call to the wrapped function
+    separately, e.g. pair_round when it runs inside a request
+    """
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not current_app.config.get("QUERY_INSTRUMENTATION", True):
+                return fn(*args, **kwargs)
+            stats = start(f"{name}{tuple(args)}")
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                finish(stats)
+
+        return wrapper
+
+    return decorator
+
+
+def start_request():
+    if current_app.config.get("QUERY_INSTRUMENTATION", True):
+        g.query_stats = start(f"{request.method} {request.path}")
+
+
+def finish_request(response):
+    stats = g.pop("query_stats", None)
+    if stats is not None:
+        summary = finish(stats)
+        response.headers["X-Query-Count"] = str(summary["queries"])
+        response.headers["X-Query-Time-Ms"] = str(summary["time_ms"])
+    return response
+
+
+def discard_request(exc=None):
+    # after_request doesn't run when a view raises, don't leave the collector behind
+    stats = g.pop("query_stats", None)
+    if stats is not None:
+        finish(stats)
+
+
+@bp.route("/debug/queries")
+def recent_queries():
+    if not current_app.config.get("QUERY_DEBUG_ENDPOINT", False):
+        abort(404)
+    return {"recent": list(reversed(current_app.extensions["query_stats"]))}
+
+
+def init_app(app):
+    global _installed
+    app.extensions["query_stats"] = deque(maxlen=app.config.get("QUERY_STATS_KEPT", 100))
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(discard_request)
+    app.register_blueprint(bp)
+    if not _installed:
+        event.listen(Engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", after_cursor_execute)
+        _installed = True
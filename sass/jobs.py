@@ -0,0 +1,149 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy.sql.expression import text
+from sass.db_grabber import get_conn, transaction
+from sass.exceptions import TournamentException
+
+
+class Job:
+    """
+    One long-running tournament operation (pairing or closing a round).
+    state goes queued -> running -> done or failed. message is shown to the TO
+    when the job finishes, next is where the admin page should go afterwards.
+    """
+
+    def __init__(self, tid, name, next_url=None, state="queued", message=None, created=None, finished=None):
+        self.tid = tid
+        self.name = name
+        self.next_url = next_url
+        self.state = state
+        self.message = message
+        self.created = time.time() if created is None else created
+        self.finished = finished
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            row["tid"],
+            row["name"],
+            row["next_url"],
+            row["state"],
+            row["message"],
+            row["created"],
+            row["finished"],
+        )
+
+    @property
+    def active(self):
+        return self.state in ("queued", "running")
+
+    def to_dict(self):
+        return {
+            "tid": self.tid,
+            "name": self.name,
+            "state": self.state,
+            "message": self.message,
+            "next": self.next_url,
+            "created": self.created,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Runs tournament operations on a thread pool, each inside its own app context.
+    Each tournament's latest job is a row in the job table, so there is at
+    most one queued or running job per tournament across every worker
+    process, and any of them can answer the admin page's status polls. A job
+    still active after JOB_TIMEOUT seconds is taken to have died with its
+    process.
+    """
+
+    def __init__(self, app, workers):
+        self.app = app
+        self.inline = not app.config.get("BACKGROUND_JOBS", True)
+        self.executor = None if self.inline else ThreadPoolExecutor(max_workers=workers)
+        self.timeout = app.config.get("JOB_TIMEOUT", 900)
+
+    def load(self, conn, tid):
+        row = conn.execute(text("SELECT * FROM job WHERE tid = :tid"), {"tid": tid}).fetchone()
+        if row is None:
+            return None
+        job = Job.from_row(row)
+        if job.active and time.time() - job.created > self.timeout:
+            job.state = "failed"
+            job.message = f"{job.name} was interrupted, try again"
+        return job
+
+    def get(self, tid):
+        return self.load(get_conn(), tid)
+
+    def submit(self, tid, name, fn, *args, next_url=None):
+        """
+        Queues fn(*args) for the tournament. Returns (job, created) where
+        created is False if the tournament already had an active job.
+        """
+        with transaction() as conn:
+            job = self.load(conn, tid)
+            if job is not None and job.active:
+                return job, False
+            job = Job(tid, name, next_url)
+            conn.execute(text("DELETE FROM job WHERE tid = :tid"), {"tid": tid})
+            conn.execute(
+                text(
+                    """
+                    INSERT INTO job (tid, name, state, next_url, created)
+                    VALUES (:tid, :name, :state, :next_url, :created)
+                    """
+                ),
+                {
+                    "tid": tid,
+                    "name": name,
+                    "state": job.state,
+                    "next_url": next_url,
+                    "created": job.created,
+                },
+            )
+        if self.inline:
+            self._run(job, fn, args)
+        else:
+            self.executor.submit(self._run, job, fn, args)
+        return job, True
+
+    def _save(self, job):
+        with transaction() as conn:
+            conn.execute(
+                text(
+                    """
+                    UPDATE job SET state = :state, message = :message, finished = :finished
+                    WHERE tid = :tid AND created = :created
+                    """
+                ),
+                job.to_dict(),
+            )
+
+    def _run(self, job, fn, args):
+        with self.app.app_context():
+            job.state = "running"
+            self._save(job)
+            try:
+                job.message = fn(*args)
+                job.state = "done"
+            except TournamentException as e:
+                job.message = str(e)
+                job.state = "failed"
+            except Exception:
+                current_app.logger.exception(f"{job.name} failed for tournament {job.tid}")
+                job.message = f"{job.name} failed, see the server log"
+                job.state = "failed"
+            job.finished = time.time()
+            self._save(job)
+
+
+def init_app(app):
+    app.extensions["jobs"] = JobQueue(app, app.config.get("JOB_WORKERS", 2))
+
+
+def get_jobs():
+    return current_app.extensions["jobs"]
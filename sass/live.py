@@ -0,0 +1,205 @@
+import json
+import queue
+import threading
+import time
+from flask import Blueprint, Response, current_app, request
+from sqlalchemy import bindparam
+from sqlalchemy.sql.expression import text
+from sass.db_grabber import get_conn
+from sass.signals import tournament_changed
+
+bp = Blueprint("live", __name__)
+
+
+class Broadcaster:
+    """
+    Pushes page updates to the clients of this worker watching a tournament's
+    standings or one of its rounds, over Server-Sent Events.
+
+    A single thread polls the data_version of the watched tournaments (one
+    query per interval for all of them, woken straight away by writes made in
+    this process), and for each change renders each watched table once and
+    hands it to every client watching it. Writes made by other workers are
+    picked up by the poll.
+
+    Each open stream holds a worker thread for as long as it lasts, so the
+    app needs threaded or async workers (e.g. gunicorn -k gthread or gevent)
+    with room for the expected viewers. Streams are closed after
+    LIVE_STREAM_LIFETIME seconds and the browser reconnects by itself, which
+    bounds how long any one client keeps a thread.
+    """
+
+    def __init__(self, app, interval, queue_size=100):
+        self.app = app
+        self.interval = interval
+        self.queue_size = queue_size
+        self.channels = {}
+        self.seen = {}
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def subscribe(self, tid, rnd, state):
+        """
+        state is the tournament as the client last saw it, see page_state
+        """
+        q = queue.Queue(self.queue_size)
+        with self.lock:
+            self.channels.setdefault((tid, rnd), set()).add(q)
+            self.seen.setdefault(tid, state)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return q
+
+    def unsubscribe(self, tid, rnd, q):
+        with self.lock:
+            subscribers = self.channels.get((tid, rnd), set())
+            subscribers.discard(q)
+            if not subscribers:
+                self.channels.pop((tid, rnd), None)
+            if not any(key[0] == tid for key in self.channels):
+                self.seen.pop(tid, None)
+
+    def notify(self, sender, tid, **kwargs):
+        self.wake.set()
+
+    def run(self):
+        while True:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            try:
+                with self.app.app_context():
+                    self.poll()
+            except Exception:
+                self.app.logger.exception("live update poll failed")
+
+    def poll(self):
+        with self.lock:
+            tids = sorted({tid for tid, rnd in self.channels})
+        if not tids:
+            return
+        rows = get_conn().execute(
+            text("SELECT id, data_version FROM tournament WHERE id IN :tids").bindparams(
+                bindparam("tids", expanding=True)
+            ),
+            {"tids": tids},
+        )
+        for row in rows.fetchall():
+            with self.lock:
+                previous = self.seen.get(row["id"])
+            if previous is not None and previous["version"] == row["data_version"]:
+                continue
+            self.changed(row["id"], previous)
+
+    def changed(self, tid, previous):
+        """
+        Renders the tables of tid's watched pages and sends them out. The
+        event is round-closed when the current round moved on, pairings when
+        rounds were paired or deleted, and result for anything else, results
+        being reported mostly.
+        """
+        with self.app.test_request_context(f"/{tid}"):
+            state = page_state(tid)
+            if previous is None:
+                kind = "result"
+            elif state["current_rnd"] != previous["current_rnd"]:
+                kind = "round-closed"
+            elif state["rounds"] != previous["rounds"]:
+                kind = "pairings"
+            else:
+                kind = "result"
+            version = state["version"]
+            with self.lock:
+                if any(key[0] == tid for key in self.channels):
+                    self.seen[tid] = state
+                channels = [
+                    (rnd, list(subscribers))
+                    for (t, rnd), subscribers in self.channels.items()
+                    if t == tid
+                ]
+            for rnd, subscribers in channels:
+                message = event(kind, version, render_table(tid, rnd))
+                for q in subscribers:
+                    try:
+                        q.put_nowait(message)
+                    except queue.Full:
+                        # Not reading, drop it, EventSource reconnects by itself
+                        self.unsubscribe(tid, rnd, q)
+
+
+def page_state(tid):
+    from sass.manager import make_data_package
+
+    data = make_data_package(tid)
+    return {
+        "version": data["t"]["data_version"],
+        "current_rnd": data["t"]["current_rnd"],
+        "rounds": len(data["rnd_list"]),
+    }
+
+
+def render_table(tid, rnd):
+    from sass.manager import render_pairings_table, render_standings_table
+
+    if rnd is None:
+        return render_standings_table(tid)
+    return render_pairings_table(tid, rnd)
+
+
+def event(kind, version, html):
+    data = json.dumps({"kind": kind, "version": version, "html": html})
+    return f"id: {version}\nevent: {kind}\ndata: {data}\n\n"
+
+
+def get_broadcaster():
+    return current_app.extensions["live"]
+
+
+@bp.route("/<int:tid>/events")
+@bp.route("/<int:tid>/<int:rnd>/events")
+def events(tid, rnd=None):
+    """
+    The page passes the data_version it was rendered at, if the tournament
+    changed since then the client gets the current table first
+    """
+    state = page_state(tid)
+    since = request.headers.get("Last-Event-ID") or request.args.get("v")
+    first = None
+    if since is not None and since != str(state["version"]):
+        first = event("result", state["version"], render_table(tid, rnd))
+    broadcaster = get_broadcaster()
+    heartbeat = current_app.config.get("LIVE_HEARTBEAT", 15)
+    lifetime = current_app.config.get("LIVE_STREAM_LIFETIME", 300)
+    q = broadcaster.subscribe(tid, rnd, state)
+
+    def stream():
+        deadline = time.monotonic() + lifetime
+        try:
+            yield "retry: 3000\n\n"
+            if first is not None:
+                yield first
+            while True:
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    # The client reconnects with the last version it got
+                    return
+                try:
+                    yield q.get(timeout=min(heartbeat, left))
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            broadcaster.unsubscribe(tid, rnd, q)
+
+    response = Response(stream(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Don't let nginx buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
+def init_app(app):
+    broadcaster = Broadcaster(app, app.config.get("LIVE_POLL_INTERVAL", 1.0))
+    app.extensions["live"] = broadcaster
+    tournament_changed.connect(broadcaster.notify, app)
+    app.register_blueprint(bp)
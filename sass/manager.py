@@ -3,6 +3,7 @@ from datetime import date, datetime
 from flask import (
     Flask,
     Blueprint,
+    current_app,
     flash,
     g,
     redirect,
@@ -21,12 +22,12 @@ from sass.db_ops import (
     delete_pairings,
     get_match,
     get_players,
+    get_standings,
     get_matches,
-    get_stats,
     get_tournament,
     get_rnd_list,
-    get_json,
     get_tournaments,
+    count_tournaments,
     db_drop_player,
     rnd_one_start,
     db_undrop_player,
@@ -40,32 +41,106 @@ from sass.tournament import (
     pair_round,
     close_round,
     record_result,
-    get_ids,
+    record_results,
     all_reported,
 )
 
 from sass.exceptions import AdminException, PairingException
+from sass.jobs import get_jobs
+from sass.db_grabber import partitioned
+from sass.cache import cached, versioned_page
+from sass.identities import get_catalog
+from sass.roster import RosterError, decode_roster, import_roster, roster_format
+from sass.nrtm import export_response
+from sass.stats import tournament_stats
+from sass.meta import meta_report
 
 bp = Blueprint("manager", __name__)
 
+RESULT_SCORES = {"c_win": (3, 0), "r_win": (0, 3), "tie": (1, 1)}
+
 
 def make_data_package(tid, rnd=None):
-    if rnd is None:
-        matches = None
-    else:
-        matches = get_matches(tid, rnd)
-    return {
-        "t": get_tournament(tid),
-        "players": get_players(tid),
-        "matches": matches,
-        "rnd_list": get_rnd_list(tid),
-        "rnd": rnd
-    }
+    """
+    Cached per tournament data_version, see sass.cache
+    """
+
+    def build():
+        if rnd is None:
+            matches = None
+        else:
+            matches = get_matches(tid, rnd)
+        return {
+            "t": get_tournament(tid),
+            "players": get_players(tid),
+            "matches": matches,
+            "rnd_list": get_rnd_list(tid),
+            "rnd": rnd
+        }
+
+    return dict(cached("package", tid, rnd, build))
+
+
+def pair_job(tid, rnd):
+    report = pair_round(tid, rnd)
+    if current_app.config.get("PAIRING_TIME_BUDGET") is None:
+        return f"Round {rnd} paired"
+    if report["exact"]:
+        return f"Round {rnd} paired, optimal pairings found, total pairing cost {report['cost']}"
+    message = f"Round {rnd} paired, time budget ran out before optimal pairings were found, total pairing cost {report['cost']}"
+    if report["forced"]:
+        message += f". {report['forced']} pairs are rematches or second byes, check them before starting the round"
+    return message
+
+
+def close_job(tid, rnd):
+    close_round(tid, rnd)
+    return f"Round {rnd} closed"
+
+
+def run_job(tid, name, fn, *args, next_url):
+    """
+    Hands a slow tournament operation to the job queue and sends the TO to the admin page,
+    which polls job_status until it's done and shows the job's message if it
+    failed. If the job ran inline and succeeded, or was already running, the
+    result or a note is flashed instead.
+
+    A queued job is remembered in the session until job_done has shown its
+    result, so the admin page waits for it even if it finished before the
+    first poll.
+    """
+    job, created = get_jobs().submit(tid, name, fn, tid, *args, next_url=next_url)
+    if not created:
+        flash(f"{job.name} is already in progress")
+    elif job.state == "done":
+        flash(job.message)
+        return redirect(next_url, code=303)
+    elif job.active:
+        session[f"job-{tid}"] = job.created
+    return redirect(url_for("manager.admin", tid=tid), code=303)
 
 
 @bp.route("/")
 def home():
-    return render_template("home.html", tournaments=get_tournaments())
+    """
+    A page of tournaments, newest first, active ones unless ?all=1. ?q=
+    searches titles and ?before= is the id the page starts below.
+    """
+    page_size = current_app.config.get("HOME_PAGE_SIZE", 50)
+    before = request.args.get("before", type=int)
+    search = request.args.get("q", "").strip()
+    show_all = request.args.get("all") == "1"
+    active = None if show_all else True
+    tournaments = get_tournaments(before, page_size + 1, active, search)
+    return render_template(
+        "home.html",
+        tournaments=tournaments[:page_size],
+        older=tournaments[page_size - 1]["id"] if len(tournaments) > page_size else None,
+        count=count_tournaments(active, search),
+        before=before,
+        search=search,
+        show_all=show_all,
+    )
 
 
 @bp.route("/create", methods=["GET", "POST"])
@@ -87,10 +162,42 @@ def create():
     return render_template("create.html")
 
 
+def render_standings(tid):
+    return render_template("t_index.html", data=make_data_package(tid))
+
+
+def render_pairings(tid, rnd):
+    data = make_data_package(tid, rnd=rnd)
+    if len(data["matches"]) == 0:
+        abort(404, f"The tournament {data['t']['title']} does not have a Round {rnd}")
+    return render_template("t_pairings.html", data=data)
+
+
+def render_standings_table(tid):
+    return render_template("t_standings_table.html", data=make_data_package(tid))
+
+
+def render_pairings_table(tid, rnd):
+    return render_template("t_pairings_table.html", data=make_data_package(tid, rnd=rnd))
+
+
 @bp.route("/<int:tid>")
 @bp.route("/<int:tid>/standings")
 def main(tid):
-    return render_template("t_index.html", data=make_data_package(tid))
+    return versioned_page(tid, None, lambda: render_standings(tid))
+
+
+@bp.route("/<int:tid>/<int:rnd>/standings")
+def round_standings(tid, rnd):
+    def render():
+        data = make_data_package(tid)
+        data["players"] = cached("standings", tid, rnd, lambda: get_standings(tid, rnd))
+        if len(data["players"]) == 0:
+            abort(404, f"Round {rnd} of {data['t']['title']} has not been closed")
+        data["standings_rnd"] = rnd
+        return render_template("t_index.html", data=data)
+
+    return versioned_page(tid, rnd, render)
 
 
 @bp.route("/<int:tid>/register", methods=["GET", "POST"])
@@ -102,33 +209,50 @@ def register(tid):
         add_player(tid, name, corp_id, runner_id)
         flash(f"{name} added to tournament")
 
-    ids = get_ids()
-    corp_ids = {card["name"]: card["faction"] for card in ids if card["side"] == "corp"}
-    runner_ids = {
-        card["name"]: card["faction"] for card in ids if card["side"] == "runner"
-    }
-    corp_order = sorted(corp_ids)
-    runner_order = sorted(runner_ids)
 
     return render_template(
         "t_register.html",
         data=make_data_package(tid),
-        ids={"corps": corp_order, "runners": runner_order},
+        ids=get_catalog().sorted_options(),
     )
 
 
-@bp.route("/<int:tid>/<int:rnd>", methods=["GET", "POST"])
-def pairings(tid, rnd):
-    t = get_tournament(tid)
-    matches = get_matches(tid, rnd)
-    if len(matches) == 0:
-        abort(404, f"The tournament {t['title']} does not have a Round {rnd}")
+@bp.route("/<int:tid>/admin/import", methods=["POST"])
+def import_players(tid):
+    """
+    Adds a CSV or JSON roster: an uploaded roster file, or the roster as the
+    request body. Answers with the import report as JSON unless it was a form
+    upload, which gets the register page with the rejected rows listed.
+    """
+    upload = request.files.get("roster")
+    dry_run = request.values.get("dry_run") in ("1", "true", "on")
+    try:
+        if upload is not None:
+            data = decode_roster(upload.read())
+            fmt = roster_format(upload.filename, upload.mimetype)
+        else:
+            data = request.get_data(as_text=True)
+            fmt = roster_format(None, request.mimetype)
+        report = import_roster(tid, data, fmt, dry_run)
+    except RosterError as e:
+        report = {"added": 0, "valid": 0, "errors": [{"row": None, "name": "", "error": str(e)}]}
+    if upload is None:
+        return report, 400 if report["errors"] and not report["valid"] else 200
+    # One flash only, a long error list would overflow the session cookie
+    flash(f"{report['added']} players added, {len(report['errors'])} rows rejected")
     return render_template(
-        "t_pairings.html",
-        data=make_data_package(tid, rnd=rnd),
+        "t_register.html",
+        data=make_data_package(tid),
+        ids=get_catalog().sorted_options(),
+        import_errors=report["errors"],
     )
 
 
+@bp.route("/<int:tid>/<int:rnd>", methods=["GET", "POST"])
+def pairings(tid, rnd):
+    return versioned_page(tid, rnd, lambda: render_pairings(tid, rnd))
+
+
 @bp.route("/<int:tid>/admin", methods=["GET", "POST", "PUT"])
 def admin(tid):
     return render_template("t_admin.html", data=make_data_package(tid))
@@ -144,19 +268,19 @@ def admin_pairings(tid, rnd):
 
 @bp.route("/<int:tid>/admin/<int:pid>/drop", methods=["GET", "PUT"])
 def drop_player(tid, pid):
-    db_drop_player(pid)
+    db_drop_player(pid, tid)
     return redirect(url_for("manager.admin", tid=tid), code=303)
 
 
 @bp.route("/<int:tid>/admin/<int:pid>/undrop", methods=["GET", "PUT"])
 def undrop_player(tid, pid):
-    db_undrop_player(pid)
+    db_undrop_player(pid, tid)
     return redirect(url_for("manager.admin", tid=tid), code=303)
 
 
 @bp.route("/<int:tid>/admin/<int:pid>/remove", methods=["POST"])
 def delete_player(tid, pid):
-    remove_player(pid)
+    remove_player(pid, tid)
     return redirect(url_for("manager.admin", tid=tid))
 
 
@@ -166,21 +290,14 @@ def edit_player(tid, pid):
         name = request.form["name"]
         corp_id = request.form["corp_id"]
         runner_id = request.form["runner_id"]
-        update_player(pid, name, corp_id, runner_id)
+        update_player(pid, name, corp_id, runner_id, tid)
         return redirect(url_for("manager.admin", tid=tid))
 
-    ids = get_ids()
-    corp_ids = {card["name"]: card["faction"] for card in ids if card["side"] == "corp"}
-    runner_ids = {
-        card["name"]: card["faction"] for card in ids if card["side"] == "runner"
-    }
-    corp_order = sorted(corp_ids)
-    runner_order = sorted(runner_ids)
-    plr = get_player(pid)
+    plr = get_player(pid, tid)
     return render_template(
         "t_player_edit.html",
         data=make_data_package(tid),
-        ids={"corps": corp_order, "runners": runner_order},
+        ids=get_catalog().sorted_options(),
         pstarter={"name": plr.p_name, "corp": plr.corp_id, "runner": plr.runner_id},
     )
 
@@ -193,39 +310,75 @@ def make_pairings(tid):
         return redirect(
             url_for("manager.admin_pairings", tid=tid, rnd=t["current_rnd"] - 1)
         )
-    print(t["current_rnd"])
     if existing_pairings(tid, t["current_rnd"]):
         flash("Pairing for this round already exists")
         return redirect(
             url_for("manager.admin_pairings", tid=tid, rnd=t["current_rnd"])
         )
-    pair_round(t["id"], t["current_rnd"])
-    return redirect(url_for("manager.pairings", tid=t["id"], rnd=t["current_rnd"]))
+    return run_job(
+        tid,
+        "Pairing",
+        pair_job,
+        t["current_rnd"],
+        next_url=url_for("manager.pairings", tid=tid, rnd=t["current_rnd"]),
+    )
 
 
 @bp.route("/reporting/<int:mid>", methods=["POST", "GET"])
-def report_result(mid):
-    if request.form["result"] == "c_win":
-        c_score = 3
-        r_score = 0
-    elif request.form["result"] == "r_win":
-        c_score = 0
-        r_score = 3
-    else:
-        c_score = 1
-        r_score = 1
-    record_result(mid, c_score, r_score)
-    match = get_match(mid)
+@bp.route("/<int:tid>/reporting/<int:mid>", methods=["POST", "GET"])
+def report_result(mid, tid=None):
+    if tid is None and partitioned():
+        # Match ids are only unique within a tournament's own database
+        abort(404)
+    c_score, r_score = RESULT_SCORES.get(request.form["result"], RESULT_SCORES["tie"])
+    record_result(mid, c_score, r_score, tid)
+    match = get_match(mid, tid)
     return redirect(url_for("manager.pairings", tid=match["tid"], rnd=match["rnd"]))
 
 
+@bp.route("/<int:tid>/<int:rnd>/results", methods=["POST"])
+def report_results(tid, rnd):
+    """
+    Many results at once, from the admin pairings form (result-<mid> fields,
+    blank ones skipped) or as JSON: {"results": [{"mid": 1, "result": "c_win"}, ...]}
+    """
+    error = None
+    if request.is_json:
+        body = request.get_json(silent=True)
+        entries = (body.get("results") or []) if isinstance(body, dict) else None
+        if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+            error = 'Expected {"results": [{"mid": ..., "result": ...}, ...]}'
+            entries = []
+        entries = [(entry.get("mid"), entry.get("result")) for entry in entries]
+    else:
+        entries = [
+            (key[len("result-") :], value)
+            for key, value in request.form.items()
+            if key.startswith("result-") and value
+        ]
+    results = {}
+    for mid, result in entries:
+        try:
+            results[int(mid)] = RESULT_SCORES[result]
+        except (KeyError, TypeError, ValueError):
+            error = f"Invalid result {result!r} for match {mid}"
+            break
+    if error is None:
+        try:
+            saved = record_results(tid, rnd, results)
+        except AdminException as e:
+            error = str(e)
+    if request.is_json:
+        if error is not None:
+            return {"error": error}, 400
+        return {"saved": saved}
+    flash(error or f"{saved} results saved")
+    return redirect(url_for("manager.admin_pairings", tid=tid, rnd=rnd), code=303)
+
+
 @bp.route("/<int:tid>/<int:rnd>/close", methods=["POST"])
 def finish_round(tid, rnd):
-    try:
-        close_round(tid, rnd)
-        return redirect(url_for("manager.admin", tid=tid), code=303)
-    except PairingException as e:
-        # print(e)
+    if not all_reported(tid, rnd):
         flash("Not all matches have results")
         return redirect(
             url_for(
@@ -234,6 +387,9 @@ def finish_round(tid, rnd):
                 rnd=rnd,
             ),
         )
+    return run_job(
+        tid, "Closing round", close_job, rnd, next_url=url_for("manager.admin", tid=tid)
+    )
 
 
 @bp.route("/<int:tid>/<int:rnd>/delete", methods=["POST"])
@@ -248,13 +404,40 @@ def start_tournament(tid):
     if t["current_rnd"] != 0:
         return redirect(url_for("manager.admin", tid=tid))
     rnd_one_start(tid)
-    pair_round(tid, 1)
-    return redirect(url_for("manager.admin_pairings", tid=tid, rnd=1))
+    return run_job(
+        tid,
+        "Pairing",
+        pair_job,
+        1,
+        next_url=url_for("manager.admin_pairings", tid=tid, rnd=1),
+    )
+
+
+@bp.route("/<int:tid>/admin/job", methods=["GET"])
+def job_status(tid):
+    job = get_jobs().get(tid)
+    if job is None:
+        return {"state": "none"}
+    return job.to_dict()
+
+
+@bp.route("/<int:tid>/admin/job/done", methods=["GET"])
+def job_done(tid):
+    """
+    Where the admin page goes when the job it was waiting for is done: the
+    job's message is flashed and the TO is sent on to the job's next page
+    """
+    session.pop(f"job-{tid}", None)
+    job = get_jobs().get(tid)
+    if job is None or job.state != "done":
+        return redirect(url_for("manager.admin", tid=tid), code=303)
+    flash(job.message)
+    return redirect(job.next_url or url_for("manager.admin", tid=tid), code=303)
 
 
 @bp.route("/<int:tid>.json", methods=["GET"])
 def report_json(tid):
-    return get_json(tid)
+    return versioned_page(tid, None, lambda: export_response(tid))
 
 
 @bp.route("/<int:tid>/changeactive", methods=["POST"])
@@ -265,4 +448,41 @@ def change_t_status(tid):
 
 @bp.route("/<int:tid>/stats", methods=["GET"])
 def stats(tid):
-    table = get_stats(tid)
+    def render():
+        return render_template(
+            "t_stats.html", data=make_data_package(tid), stats=tournament_stats(tid)
+        )
+
+    return versioned_page(tid, None, render)
+
+
+@bp.route("/<int:tid>/stats.json", methods=["GET"])
+def stats_json(tid):
+    return versioned_page(tid, None, lambda: tournament_stats(tid))
+
+
+def date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        abort(400, f"{name} must be a date like 2022-05-14")
+
+
+@bp.route("/meta.json", methods=["GET"])
+def meta_json():
+    """
+    Meta report across tournaments, filtered with ?since=&until= (dates),
+    ?last= (number of events) and ?identity=
+    """
+    last = request.args.get("last")
+    if last is not None and (not last.isdigit() or int(last) < 1):
+        abort(400, "last must be a positive number of events")
+    return meta_report(
+        since=date_arg("since"),
+        until=date_arg("until"),
+        last=int(last) if last is not None else None,
+        identity=request.args.get("identity") or None,
+    )
@@ -0,0 +1,446 @@
+from networkx import Graph, max_weight_matching
+from sass.exceptions import PairingException, PairingTimeout
+
+
+class Matcher:
+    """
+    Maximum weight, maximum cardinality matching backend.
+    match() takes the number of vertices (0..n-1) and three parallel integer
+    arrays describing the edges: endpoints u and v, and the edge weight.
+    It returns a sorted list of (i, j) pairs with i < j.
+
+    cancel is an optional threading.Event. Backends that can stop early raise
+    PairingTimeout once it is set, the others ignore it and say so with
+    cancellable = False.
+    """
+
+    name = None
+    cancellable = False
+
+    def match(self, n, u, v, weight, cancel=None):
+        raise NotImplementedError
+
+
+class NetworkxMatcher(Matcher):
+    """
+    networkx.max_weight_matching, kept as the reference implementation.
+    Can't be cancelled.
+    """
+
+    name = "networkx"
+
+    def match(self, n, u, v, weight, cancel=None):
+        graph = Graph()
+        graph.add_nodes_from(range(n))
+        graph.add_weighted_edges_from(zip(list(u), list(v), list(weight)))
+        pairings = max_weight_matching(graph, maxcardinality=True)
+        return sorted(tuple(sorted(pair)) for pair in pairings)
+
+
+class BlossomMatcher(Matcher):
+    """
+    Edmonds' primal-dual blossom algorithm over flat integer arrays.
+    Same algorithm networkx uses (after Van Rantwijk's mwmatching), but with
+    vertices, blossoms and edges as list indexes instead of dicts of node
+    objects, and integer-only dual arithmetic, which Swiss weights allow.
+    """
+
+    name = "blossom"
+    cancellable = True
+
+    def match(self, n, u, v, weight, cancel=None):
+        mate = blossom_matching(n, list(u), list(v), list(weight), cancel)
+        return sorted((i, j) for i, j in enumerate(mate) if i < j)
+
+
+MATCHERS = {matcher.name: matcher for matcher in (NetworkxMatcher, BlossomMatcher)}
+
+
+def get_matcher(name):
+    try:
+        return MATCHERS[name]()
+    except KeyError:
+        raise PairingException(f"Unknown pairing matcher {name}")
+
+
+def blossom_matching(n, eu, ev, ew, cancel=None):
+    """
+    Maximum cardinality matching of maximum weight among those.
+    Returns mate, where mate[i] is the vertex matched to i or -1.
+    Raises PairingTimeout if the cancel event gets set while it runs.
+
+    Edge k joins eu[k] and ev[k] with integer weight ew[k]. Endpoint 2k is
+    eu[k] and endpoint 2k+1 is ev[k], so p ^ 1 is the other end of an edge
+    and p // 2 is the edge. Blossoms are numbered n..2n-1.
+    """
+    nedge = len(ew)
+    if nedge == 0:
+        return [-1] * n
+
+    endpoint = [0] * (2 * nedge)
+    neighbend = [[] for _ in range(n)]
+    for k in range(nedge):
+        i, j = eu[k], ev[k]
+        endpoint[2 * k] = i
+        endpoint[2 * k + 1] = j
+        neighbend[i].append(2 * k + 1)
+        neighbend[j].append(2 * k)
+
+    # mate[v] is the remote endpoint of v's matched edge, or -1
+    mate = [-1] * n
+    # label: 0 free, 1 S (outer), 2 T (inner), 5 marks a blossom during scan_blossom
+    label = [0] * (2 * n)
+    labelend = [-1] * (2 * n)
+    inblossom = list(range(n))
+    blossomparent = [-1] * (2 * n)
+    blossomchilds = [None] * (2 * n)
+    blossombase = list(range(n)) + [-1] * n
+    blossomendps = [None] * (2 * n)
+    bestedge = [-1] * (2 * n)
+    blossombestedges = [None] * (2 * n)
+    unusedblossoms = list(range(n, 2 * n))
+    # Duals are doubled relative to the textbook so everything stays integer
+    dualvar = [max(0, max(ew))] * n + [0] * n
+    allowedge = [False] * nedge
+    queue = []
+
+    def slack(k):
+        return dualvar[eu[k]] + dualvar[ev[k]] - 2 * ew[k]
+
+    def blossom_leaves(b):
+        if b < n:
+            yield b
+        else:
+            for t in blossomchilds[b]:
+                if t < n:
+                    yield t
+                else:
+                    yield from blossom_leaves(t)
+
+    def assign_label(w, t, p):
+        b = inblossom[w]
+        label[w] = label[b] = t
+        labelend[w] = labelend[b] = p
+        bestedge[w] = bestedge[b] = -1
+        if t == 1:
+            queue.extend(blossom_leaves(b))
+        else:
+            base = blossombase[b]
+            assign_label(endpoint[mate[base]], 1, mate[base] ^ 1)
+
+    def scan_blossom(v, w):
+        # Trace back from v and w to find a new blossom base, or -1 for an augmenting path
+        path = []
+        base = -1
+        while v != -1 or w != -1:
+            b = inblossom[v]
+            if label[b] & 4:
+                base = blossombase[b]
+                break
+            path.append(b)
+            label[b] = 5
+            if labelend[b] == -1:
+                v = -1
+            else:
+                v = endpoint[labelend[b]]
+                b = inblossom[v]
+                v = endpoint[labelend[b]]
+            if w != -1:
+                v, w = w, v
+        for b in path:
+            label[b] = 1
+        return base
+
+    def add_blossom(base, k):
+        v, w = eu[k], ev[k]
+        bb = inblossom[base]
+        bv = inblossom[v]
+        bw = inblossom[w]
+        b = unusedblossoms.pop()
+        blossombase[b] = base
+        blossomparent[b] = -1
+        blossomparent[bb] = b
+        blossomchilds[b] = path = []
+        blossomendps[b] = endps = []
+        while bv != bb:
+            blossomparent[bv] = b
+            path.append(bv)
+            endps.append(labelend[bv])
+            v = endpoint[labelend[bv]]
+            bv = inblossom[v]
+        path.append(bb)
+        path.reverse()
+        endps.reverse()
+        endps.append(2 * k)
+        while bw != bb:
+            blossomparent[bw] = b
+            path.append(bw)
+            endps.append(labelend[bw] ^ 1)
+            w = endpoint[labelend[bw]]
+            bw = inblossom[w]
+        label[b] = 1
+        labelend[b] = labelend[bb]
+        dualvar[b] = 0
+        for v in blossom_leaves(b):
+            if label[inblossom[v]] == 2:
+                queue.append(v)
+            inblossom[v] = b
+
+        # Keep the least-slack edge from the new blossom to each other S-blossom
+        bestedgeto = {}
+        for bv in path:
+            if blossombestedges[bv] is None:
+                nblist = [p // 2 for leaf in blossom_leaves(bv) for p in neighbend[leaf]]
+            else:
+                nblist = blossombestedges[bv]
+            for k in nblist:
+                i, j = eu[k], ev[k]
+                if inblossom[j] == b:
+                    i, j = j, i
+                bj = inblossom[j]
+                if bj != b and label[bj] == 1:
+                    best = bestedgeto.get(bj, -1)
+                    if best == -1 or slack(k) < slack(best):
+                        bestedgeto[bj] = k
+            blossombestedges[bv] = None
+            bestedge[bv] = -1
+        blossombestedges[b] = list(bestedgeto.values())
+        bestedge[b] = -1
+        for k in blossombestedges[b]:
+            if bestedge[b] == -1 or slack(k) < slack(bestedge[b]):
+                bestedge[b] = k
+
+    def expand_blossom(b, endstage):
+        for s in blossomchilds[b]:
+            blossomparent[s] = -1
+            if s < n:
+                inblossom[s] = s
+            elif endstage and dualvar[s] == 0:
+                expand_blossom(s, endstage)
+            else:
+                for v in blossom_leaves(s):
+                    inblossom[v] = s
+
+        if not endstage and label[b] == 2:
+            # Relabel the children along the even path through the blossom
+            entrychild = inblossom[endpoint[labelend[b] ^ 1]]
+            j = blossomchilds[b].index(entrychild)
+            if j & 1:
+                j -= len(blossomchilds[b])
+                jstep = 1
+                endptrick = 0
+            else:
+                jstep = -1
+                endptrick = 1
+            p = labelend[b]
+            while j != 0:
+                label[endpoint[p ^ 1]] = 0
+                label[endpoint[blossomendps[b][j - endptrick] ^ endptrick ^ 1]] = 0
+                assign_label(endpoint[p ^ 1], 2, p)
+                allowedge[blossomendps[b][j - endptrick] // 2] = True
+                j += jstep
+                p = blossomendps[b][j - endptrick] ^ endptrick
+                allowedge[p // 2] = True
+                j += jstep
+            bv = blossomchilds[b][j]
+            label[endpoint[p ^ 1]] = label[bv] = 2
+            labelend[endpoint[p ^ 1]] = labelend[bv] = p
+            bestedge[bv] = -1
+            j += jstep
+            while blossomchilds[b][j] != entrychild:
+                bv = blossomchilds[b][j]
+                if label[bv] == 1:
+                    j += jstep
+                    continue
+                for v in blossom_leaves(bv):
+                    if label[v] != 0:
+                        break
+                if label[v] != 0:
+                    label[v] = 0
+                    label[endpoint[mate[blossombase[bv]]]] = 0
+                    assign_label(v, 2, labelend[v])
+                j += jstep
+
+        label[b] = labelend[b] = -1
+        blossomchilds[b] = blossomendps[b] = None
+        blossombase[b] = -1
+        blossombestedges[b] = None
+        bestedge[b] = -1
+        unusedblossoms.append(b)
+
+    def augment_blossom(b, v):
+        # Swap matched and unmatched edges along the path from v to the base of b
+        t = v
+        while blossomparent[t] != b:
+            t = blossomparent[t]
+        if t >= n:
+            augment_blossom(t, v)
+        i = j = blossomchilds[b].index(t)
+        if i & 1:
+            j -= len(blossomchilds[b])
+            jstep = 1
+            endptrick = 0
+        else:
+            jstep = -1
+            endptrick = 1
+        while j != 0:
+            j += jstep
+            t = blossomchilds[b][j]
+            p = blossomendps[b][j - endptrick] ^ endptrick
+            if t >= n:
+                augment_blossom(t, endpoint[p])
+            j += jstep
+            t = blossomchilds[b][j]
+            if t >= n:
+                augment_blossom(t, endpoint[p ^ 1])
+            mate[endpoint[p]] = p ^ 1
+            mate[endpoint[p ^ 1]] = p
+        blossomchilds[b] = blossomchilds[b][i:] + blossomchilds[b][:i]
+        blossomendps[b] = blossomendps[b][i:] + blossomendps[b][:i]
+        blossombase[b] = blossombase[blossomchilds[b][0]]
+
+    def augment_matching(k):
+        for s, p in ((eu[k], 2 * k + 1), (ev[k], 2 * k)):
+            while True:
+                bs = inblossom[s]
+                if bs >= n:
+                    augment_blossom(bs, s)
+                mate[s] = p
+                if labelend[bs] == -1:
+                    break
+                t = endpoint[labelend[bs]]
+                bt = inblossom[t]
+                s = endpoint[labelend[bt]]
+                j = endpoint[labelend[bt] ^ 1]
+                if bt >= n:
+                    augment_blossom(bt, j)
+                mate[j] = labelend[bt]
+                p = labelend[bt] ^ 1
+
+    for _ in range(n):
+        # Each stage finds one augmenting path, or proves there isn't one
+        label[:] = [0] * (2 * n)
+        bestedge[:] = [-1] * (2 * n)
+        blossombestedges[n:] = [None] * n
+        allowedge[:] = [False] * nedge
+        queue[:] = []
+
+        for v in range(n):
+            if mate[v] == -1 and label[inblossom[v]] == 0:
+                assign_label(v, 1, -1)
+
+        augmented = False
+        while True:
+            if cancel is not None and cancel.is_set():
+                raise PairingTimeout("Matching cancelled")
+            while queue and not augmented:
+                v = queue.pop()
+                bv = inblossom[v]
+                for p in neighbend[v]:
+                    k = p // 2
+                    w = endpoint[p]
+                    bw = inblossom[w]
+                    if bv == bw:
+                        continue
+                    if not allowedge[k]:
+                        kslack = dualvar[v] + dualvar[w] - 2 * ew[k]
+                        if kslack <= 0:
+                            allowedge[k] = True
+                    if allowedge[k]:
+                        if label[bw] == 0:
+                            assign_label(w, 2, p ^ 1)
+                        elif label[bw] == 1:
+                            base = scan_blossom(v, w)
+                            if base >= 0:
+                                add_blossom(base, k)
+                                bv = inblossom[v]
+                            else:
+                                augment_matching(k)
+                                augmented = True
+                                break
+                        elif label[w] == 0:
+                            label[w] = 2
+                            labelend[w] = p ^ 1
+                    elif label[bw] == 1:
+                        if bestedge[bv] == -1 or kslack < slack(bestedge[bv]):
+                            bestedge[bv] = k
+                    elif label[w] == 0:
+                        if bestedge[w] == -1 or kslack < slack(bestedge[w]):
+                            bestedge[w] = k
+
+            if augmented:
+                break
+
+            # No tight edge left to follow, so change the duals
+            deltatype = -1
+            delta = deltaedge = deltablossom = None
+            for v in range(n):
+                if label[inblossom[v]] == 0 and bestedge[v] != -1:
+                    d = slack(bestedge[v])
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 2
+                        deltaedge = bestedge[v]
+            for b in range(2 * n):
+                if blossomparent[b] == -1 and label[b] == 1 and bestedge[b] != -1:
+                    d = slack(bestedge[b]) // 2
+                    if deltatype == -1 or d < delta:
+                        delta = d
+                        deltatype = 3
+                        deltaedge = bestedge[b]
+            for b in range(n, 2 * n):
+                if (
+                    blossombase[b] >= 0
+                    and blossomparent[b] == -1
+                    and label[b] == 2
+                    and (deltatype == -1 or dualvar[b] < delta)
+                ):
+                    delta = dualvar[b]
+                    deltatype = 4
+                    deltablossom = b
+            if deltatype == -1:
+                # Max cardinality reached, one last dual update for optimality
+                deltatype = 1
+                delta = max(0, min(dualvar[:n]))
+
+            for v in range(n):
+                lbl = label[inblossom[v]]
+                if lbl == 1:
+                    dualvar[v] -= delta
+                elif lbl == 2:
+                    dualvar[v] += delta
+            for b in range(n, 2 * n):
+                if blossombase[b] >= 0 and blossomparent[b] == -1:
+                    if label[b] == 1:
+                        dualvar[b] += delta
+                    elif label[b] == 2:
+                        dualvar[b] -= delta
+
+            if deltatype == 1:
+                break
+            elif deltatype == 2:
+                allowedge[deltaedge] = True
+                i, j = eu[deltaedge], ev[deltaedge]
+                if label[inblossom[i]] == 0:
+                    i, j = j, i
+                queue.append(i)
+            elif deltatype == 3:
+                allowedge[deltaedge] = True
+                queue.append(eu[deltaedge])
+            else:
+                expand_blossom(deltablossom, False)
+
+        if not augmented:
+            break
+
+        # Expand S-blossoms whose dual dropped to zero before the next stage
+        for b in range(n, 2 * n):
+            if (
+                blossomparent[b] == -1
+                and blossombase[b] >= 0
+                and label[b] == 1
+                and dualvar[b] == 0
+            ):
+                expand_blossom(b, True)
+
+    return [endpoint[p] if p != -1 else -1 for p in mate]
@@ -0,0 +1,270 @@
+from datetime import timedelta
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.sql.expression import text
+from sass.cache import VersionedCache
+from sass.db_grabber import get_conn, transaction
+from sass.db_ops import get_stats
+from sass.identities import get_catalog
+from sass.stats import add, identity_name, round_tally, summarize
+
+COUNTS = ("games", "corp_wins", "runner_wins", "ties")
+
+
+def summary_rows(tid, upto):
+    """
+    The tournament's (corp identity, runner identity) -> [games, corp wins,
+    runner wins, ties] over the reported results between real players in
+    rounds up to upto, from the same aggregate query as its stats page
+    """
+    rows = {}
+    for row in get_stats(tid):
+        if row["rnd"] <= upto:
+            key = (identity_name(row["corp_identity"]), identity_name(row["runner_identity"]))
+            add(rows.setdefault(key, [0, 0, 0, 0]), tuple(row)[3:])
+    return rows
+
+
+def month_of(t_date):
+    # t_date is a 'YYYY-MM-DD' string on SQLite and a timestamp on Postgres
+    return str(t_date)[:7]
+
+
+def save_summary(conn, tid, rows):
+    """
+    Replaces the tournament's meta_summary rows, conn being a transaction on
+    the main database, and applies the difference to its month's
+    meta_monthly rows. Its meta_version is moved past every other one, so
+    the newest version always tells whether any summary changed.
+    """
+    t = conn.execute(text("SELECT t_date FROM tournament WHERE id = :tid"), {"tid": tid}).fetchone()
+    delta = {key: list(counts) for key, counts in rows.items()}
+    for old in conn.execute(
+        text("SELECT * FROM meta_summary WHERE tid = :tid"), {"tid": tid}
+    ).fetchall():
+        add(
+            delta.setdefault((old["corp_identity"], old["runner_identity"]), [0, 0, 0, 0]),
+            [-old[count] for count in COUNTS],
+        )
+    conn.execute(text("DELETE FROM meta_summary WHERE tid = :tid"), {"tid": tid})
+    if rows:
+        conn.execute(
+            text(
+                """
+                INSERT INTO meta_summary
+                (tid, corp_identity, runner_identity, games, corp_wins, runner_wins, ties)
+                VALUES (:tid, :corp, :runner, :games, :corp_wins, :runner_wins, :ties)
+                """
+            ),
+            [
+                dict(zip(COUNTS, counts), tid=tid, corp=corp, runner=runner)
+                for (corp, runner), counts in rows.items()
+            ],
+        )
+    changes = [
+        dict(zip(COUNTS, counts), month=month_of(t["t_date"]), corp=corp, runner=runner)
+        for (corp, runner), counts in delta.items()
+        if any(counts)
+    ]
+    if changes:
+        conn.execute(
+            text(
+                """
+                INSERT INTO meta_monthly
+                (month, corp_identity, runner_identity, games, corp_wins, runner_wins, ties)
+                VALUES (:month, :corp, :runner, :games, :corp_wins, :runner_wins, :ties)
+                ON CONFLICT (month, corp_identity, runner_identity) DO UPDATE SET
+                games = meta_monthly.games + excluded.games,
+                corp_wins = meta_monthly.corp_wins + excluded.corp_wins,
+                runner_wins = meta_monthly.runner_wins + excluded.runner_wins,
+                ties = meta_monthly.ties + excluded.ties
+                """
+            ),
+            changes,
+        )
+        conn.execute(
+            text("DELETE FROM meta_monthly WHERE month = :month AND games = 0"),
+            {"month": month_of(t["t_date"])},
+        )
+    conn.execute(
+        text(
+            """
+            UPDATE tournament SET meta_version = (SELECT MAX(meta_version) FROM tournament) + 1
+            WHERE id = :tid
+            """
+        ),
+        {"tid": tid},
+    )
+
+
+def meta_version():
+    q = get_conn().execute(text("SELECT MAX(meta_version) AS version FROM tournament")).fetchone()
+    return q["version"] or 0
+
+
+def events_query(since, before, last):
+    """
+    The ids of the summarized tournaments dated since <= t_date < before,
+    only the last ones by date if last is given
+    """
+    where = ["meta_version > 0"]
+    if since is not None:
+        where.append("t_date >= :since")
+    if before is not None:
+        where.append("t_date < :before")
+    query = "SELECT id FROM tournament WHERE " + " AND ".join(where)
+    if last is not None:
+        query += " ORDER BY t_date DESC, id DESC LIMIT :last"
+    return query
+
+
+def identity_filter(identity):
+    if identity is None:
+        return []
+    return ["(s.corp_identity = :identity OR s.runner_identity = :identity)"]
+
+
+def event_groups(conn, since, before, last, identity):
+    """
+    (corp identity, runner identity, games, corp wins, runner wins, ties)
+    over the tournaments picked by events_query, from meta_summary
+    """
+    where = [f"s.tid IN ({events_query(since, before, last)})"] + identity_filter(identity)
+    return conn.execute(
+        text(
+            f"""
+            SELECT s.corp_identity, s.runner_identity, SUM(s.games) AS games,
+            SUM(s.corp_wins) AS corp_wins, SUM(s.runner_wins) AS runner_wins,
+            SUM(s.ties) AS ties
+            FROM meta_summary s
+            WHERE {" AND ".join(where)}
+            GROUP BY s.corp_identity, s.runner_identity
+            """
+        ),
+        {"since": since, "before": before, "last": last, "identity": identity},
+    ).fetchall()
+
+
+def months_query(first, end, identity):
+    where = identity_filter(identity)
+    if first is not None:
+        where.append("s.month >= :first")
+    if end is not None:
+        where.append("s.month < :end")
+    return f"""
+        SELECT s.corp_identity, s.runner_identity, SUM(s.games) AS games,
+        SUM(s.corp_wins) AS corp_wins, SUM(s.runner_wins) AS runner_wins,
+        SUM(s.ties) AS ties
+        FROM meta_monthly s
+        {"WHERE " + " AND ".join(where) if where else ""}
+        GROUP BY s.corp_identity, s.runner_identity
+    """
+
+
+def month_groups(conn, first, end, identity):
+    """
+    The same for every tournament in the months first <= month < end, from meta_monthly
+    """
+    return conn.execute(
+        text(months_query(first, end, identity)),
+        {"first": first, "end": end, "identity": identity},
+    ).fetchall()
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def isoformat(day):
+    return day.isoformat() if day is not None else None
+
+
+def compute_report(since=None, until=None, last=None, identity=None):
+    """
+    The months wholly between since and until are added up from
+    meta_monthly, only the tournaments in the part months at either end
+    (or the last ones, with last) from meta_summary
+    """
+    conn = get_conn()
+    before = until + timedelta(days=1) if until is not None else None
+    first = since if since is None or since.day == 1 else next_month(since)
+    end = before.replace(day=1) if before is not None else None
+    if last is not None or (first is not None and end is not None and first >= end):
+        groups = event_groups(conn, isoformat(since), isoformat(before), last, identity)
+    else:
+        groups = month_groups(
+            conn,
+            month_of(first) if first is not None else None,
+            month_of(end) if end is not None else None,
+            identity,
+        )
+        if first != since:
+            groups += event_groups(conn, isoformat(since), isoformat(first), None, identity)
+        if end != before:
+            groups += event_groups(conn, isoformat(end), isoformat(before), None, identity)
+    count = conn.execute(
+        text(f"SELECT COUNT(*) AS events FROM ({events_query(since, before, last)}) e"),
+        {"since": isoformat(since), "before": isoformat(before), "last": last},
+    ).fetchone()
+    return dict(summarize(round_tally(groups)), events=count["events"])
+
+
+def meta_report(since=None, until=None, last=None, identity=None):
+    """
+    Identity and faction win rates and matchups over every summarized
+    tournament dated between since and until (dates, both included), or
+    the last ones of those. With identity, only games it played in count.
+
+    Only the summary tables are read, and the report is cached until any
+    tournament's summary changes.
+    """
+    if identity is not None:
+        card = get_catalog().lookup(identity)
+        identity = card["name"] if card is not None else identity_name(identity.strip())
+    filters = {
+        "since": since.isoformat() if since is not None else None,
+        "until": until.isoformat() if until is not None else None,
+        "last": last,
+        "identity": identity,
+    }
+    key = ("meta", None, tuple(filters.values()), meta_version())
+    cache = current_app.extensions["meta_reports"]
+    report = cache.get(key)
+    if report is None:
+        report = dict(compute_report(since, until, last, identity), filters=filters)
+        cache.put(key, report)
+    return report
+
+
+def rebuild_summaries():
+    """
+    Summarizes every tournament's closed rounds again, for databases that
+    predate the summary tables
+    """
+    with transaction() as conn:
+        conn.execute(text("DELETE FROM meta_summary"))
+        conn.execute(text("DELETE FROM meta_monthly"))
+    tournaments = (
+        get_conn()
+        .execute(text("SELECT id, current_rnd FROM tournament WHERE current_rnd > 1"))
+        .fetchall()
+    )
+    for t in tournaments:
+        rows = summary_rows(t["id"], t["current_rnd"] - 1)
+        with transaction() as conn:
+            save_summary(conn, t["id"], rows)
+    return len(tournaments)
+
+
+@click.command("rebuild-meta")
+@with_appcontext
+def rebuild_meta_command():
+    """Rebuild the cross tournament meta summaries from the matches."""
+    count = rebuild_summaries()
+    click.echo(f"summarized {count} tournaments")
+
+
+def init_app(app):
+    app.extensions["meta_reports"] = VersionedCache(app.config.get("META_REPORT_CACHE_SIZE", 256))
+    app.cli.add_command(rebuild_meta_command)
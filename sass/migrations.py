@@ -0,0 +1,343 @@
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import inspect
+from sqlalchemy.sql.expression import bindparam, text
+from werkzeug.exceptions import abort
+from sass.db_grabber import get_conn, get_db, partition_tids, reflect, transaction
+
+# (version, description, statements, where). Append new migrations to the end,
+# never edit one that has shipped. Statements have to work on both SQLite and
+# Postgres. In partitioned mode "all" migrations run against every tournament's
+# database as well, "main" ones only touch the tournament list.
+MIGRATIONS = [
+    (
+        1,
+        "standings snapshots",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS standings_snapshot (
+                tid INTEGER NOT NULL,
+                rnd INTEGER NOT NULL,
+                rank INTEGER NOT NULL,
+                pid INTEGER NOT NULL,
+                score INTEGER,
+                sos REAL,
+                esos REAL,
+                bias INTEGER,
+                corp_points INTEGER DEFAULT 0,
+                runner_points INTEGER DEFAULT 0,
+                PRIMARY KEY (tid, rnd, rank),
+                FOREIGN KEY (tid) REFERENCES tournament (id),
+                FOREIGN KEY (pid) REFERENCES player (id)
+            )
+            """,
+        ],
+        "all",
+    ),
+    (
+        2,
+        "indexes for round, rematch and roster lookups",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_match_tid_rnd ON match (tid, rnd)",
+            "CREATE INDEX IF NOT EXISTS ix_match_corp_runner ON match (corp_id, runner_id)",
+            "CREATE INDEX IF NOT EXISTS ix_match_runner_corp ON match (runner_id, corp_id)",
+            "CREATE INDEX IF NOT EXISTS ix_player_tid_active ON player (tid, active)",
+            "CREATE INDEX IF NOT EXISTS ix_player_tid_is_bye ON player (tid, is_bye)",
+        ],
+        "all",
+    ),
+    (
+        3,
+        "tournament data versions",
+        ["ALTER TABLE tournament ADD COLUMN data_version INTEGER NOT NULL DEFAULT 0"],
+        "main",
+    ),
+    (
+        4,
+        "meta summaries across tournaments",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS meta_summary (
+                tid INTEGER NOT NULL,
+                corp_identity TEXT NOT NULL,
+                runner_identity TEXT NOT NULL,
+                games INTEGER NOT NULL DEFAULT 0,
+                corp_wins INTEGER NOT NULL DEFAULT 0,
+                runner_wins INTEGER NOT NULL DEFAULT 0,
+                ties INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (tid, corp_identity, runner_identity),
+                FOREIGN KEY (tid) REFERENCES tournament (id)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_meta_summary_corp ON meta_summary (corp_identity, tid)",
+            "CREATE INDEX IF NOT EXISTS ix_meta_summary_runner ON meta_summary (runner_identity, tid)",
+            """
+            CREATE TABLE IF NOT EXISTS meta_monthly (
+                month TEXT NOT NULL,
+                corp_identity TEXT NOT NULL,
+                runner_identity TEXT NOT NULL,
+                games INTEGER NOT NULL DEFAULT 0,
+                corp_wins INTEGER NOT NULL DEFAULT 0,
+                runner_wins INTEGER NOT NULL DEFAULT 0,
+                ties INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (month, corp_identity, runner_identity)
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_meta_monthly_corp ON meta_monthly (corp_identity, month)",
+            "CREATE INDEX IF NOT EXISTS ix_meta_monthly_runner ON meta_monthly (runner_identity, month)",
+            "ALTER TABLE tournament ADD COLUMN meta_version INTEGER NOT NULL DEFAULT 0",
+            "CREATE INDEX IF NOT EXISTS ix_tournament_meta_version ON tournament (meta_version)",
+            "CREATE INDEX IF NOT EXISTS ix_tournament_date ON tournament (t_date)",
+        ],
+        "main",
+    ),
+    (
+        5,
+        "indexes for the tournament list",
+        [
+            "CREATE INDEX IF NOT EXISTS ix_tournament_active_id ON tournament (active, id)",
+            "CREATE INDEX IF NOT EXISTS ix_tournament_title ON tournament (lower(title))",
+        ],
+        "main",
+    ),
+    (
+        6,
+        "job table",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS job (
+                tid INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                state TEXT NOT NULL,
+                message TEXT,
+                next_url TEXT,
+                created DOUBLE PRECISION NOT NULL,
+                finished DOUBLE PRECISION,
+                FOREIGN KEY (tid) REFERENCES tournament (id)
+            )
+            """,
+        ],
+        "main",
+    ),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+PLACEHOLDERS = {
+    "tid": 1,
+    "rnd": 1,
+    "pids": [1, 2],
+}
+
+
+def index_checks():
+    """
+    (description, statement, parameters, indexes it must use) for the
+    queries the pairing, reporting, standings and listing code runs on
+    every request. The statements are the ones those modules execute.
+    """
+    from sass import db_ops, meta, pairing, standings, tournament
+
+    tournament_page = db_ops.tournaments_query(before=100, limit=50, active=True)
+    title_search = db_ops.tournaments_query(limit=50, search="a")
+    return [
+        ("matches in a round", db_ops.ROUND_MATCHES, {}, ("ix_match_tid_rnd",)),
+        ("round already paired", tournament.ROUND_PAIRED, {}, ("ix_match_tid_rnd",)),
+        ("unreported matches in a round", tournament.UNREPORTED_MATCHES, {}, ("ix_match_tid_rnd",)),
+        ("pairing history", pairing.MATCH_HISTORY, {}, ("ix_match_tid_rnd",)),
+        (
+            "matches of reported players",
+            standings.PLAYER_MATCHES,
+            {},
+            ("ix_match_corp_runner", "ix_match_runner_corp"),
+        ),
+        ("active players", db_ops.ACTIVE_PLAYERS, {}, ("ix_player_tid_active",)),
+        (
+            "live standings",
+            db_ops.LIVE_STANDINGS.text,
+            {},
+            ("ix_player_tid_is_bye", "ix_match_corp_runner", "ix_match_runner_corp"),
+        ),
+        ("closed round standings", db_ops.SNAPSHOT_STANDINGS, {}, ("ix_player_tid_is_bye",)),
+        ("tournament list page", *tournament_page, ("ix_tournament_active_id",)),
+        ("tournament title search", *title_search, ("ix_tournament_title",)),
+        (
+            "meta report events by date",
+            meta.events_query("2022-01-01", "2022-02-01", None),
+            {"since": "2022-01-01", "before": "2022-02-01"},
+            ("ix_tournament_date",),
+        ),
+        (
+            "meta report for an identity",
+            meta.months_query(None, None, "-"),
+            {"identity": "-"},
+            ("ix_meta_monthly_corp", "ix_meta_monthly_runner"),
+        ),
+    ]
+
+
+def ensure_version_table(conn):
+    conn.execute(
+        text(
+            """
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                description TEXT,
+                applied TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """
+        )
+    )
+
+
+def current_version(conn):
+    ensure_version_table(conn)
+    q = conn.execute(text("SELECT MAX(version) AS version FROM schema_version")).fetchone()
+    return q["version"] or 0
+
+
+def stored_version(conn):
+    """
+    current_version without creating anything, None for a database init-db
+    hasn't been run on
+    """
+    inspector = inspect(conn)
+    if not inspector.has_table("tournament"):
+        return None
+    if not inspector.has_table("schema_version"):
+        return 0
+    return current_version(conn)
+
+
+def schema_problem():
+    version = stored_version(get_conn())
+    if version is None:
+        return "The database has no tables, run flask init-db"
+    if version < LATEST:
+        return f"The database is at schema version {version} but needs {LATEST}, run flask migrate-db"
+    return None
+
+
+def check_schema():
+    """
+    Until the database has been migrated every request gets a 503 saying so,
+    instead of a 500 from the first query to touch a missing column.
+    """
+    if current_app.extensions.get("schema_checked"):
+        return
+    problem = schema_problem()
+    if problem is not None:
+        abort(503, problem)
+    current_app.extensions["schema_checked"] = True
+
+
+def record_version(conn, version, description):
+    conn.execute(
+        text("INSERT INTO schema_version (version, description) VALUES (:version, :description)"),
+        {"version": version, "description": description},
+    )
+
+
+def migrate(target=None, tid=None):
+    """
+    Applies every migration newer than the database (tid's partition, if
+    given), each in its own transaction along with its schema_version row.
+    Returns the versions applied.
+    """
+    if target is None:
+        target = LATEST
+    applied = []
+    for version, description, statements, where in MIGRATIONS:
+        if version > target:
+            break
+        with transaction(tid, changes=False) as conn:
+            if version <= current_version(conn):
+                continue
+            if where == "all" or tid is None:
+                for statement in statements:
+                    conn.execute(text(statement))
+            record_version(conn, version, description)
+        applied.append(version)
+    if applied:
+        reflect(get_db())
+    return applied
+
+
+def stamp(conn):
+    """
+    Marks a freshly created schema as up to date, init_db's schema files
+    already include everything the migrations add.
+    """
+    ensure_version_table(conn)
+    conn.execute(text("DELETE FROM schema_version"))
+    for version, description, statements, where in MIGRATIONS:
+        record_version(conn, version, description)
+
+
+def explain(conn, statement, params):
+    params = dict(PLACEHOLDERS, **params)
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    query = text(prefix + statement)
+    if ":pids" in statement:
+        query = query.bindparams(bindparam("pids", expanding=True))
+    rows = conn.execute(query, params)
+    if conn.dialect.name == "sqlite":
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def check_indexes(tid=None):
+    """
+    Returns (description, indexes, uses_indexes, plan) for each of index_checks
+    """
+    results = []
+    conn = get_conn(tid)
+    for description, statement, params, indexes in index_checks():
+        plan = explain(conn, statement, params)
+        used = all(any(index in line for line in plan) for index in indexes)
+        results.append((description, indexes, used, plan))
+    return results
+
+
+@click.command("migrate-db")
+@click.option("--target", type=int, default=None, help="Stop at this schema version.")
+@with_appcontext
+def migrate_db_command(target):
+    """Upgrade the existing database in place to the latest schema."""
+    for tid in [None] + partition_tids():
+        name = "database" if tid is None else f"tournament {tid} database"
+        applied = migrate(target, tid)
+        version = current_version(get_conn(tid))
+        if applied:
+            click.echo(f"{name}: applied migrations {', '.join(str(v) for v in applied)}")
+        click.echo(f"{name} is at schema version {version}")
+
+
+@click.command("check-indexes")
+@click.option("--tid", type=int, default=None, help="Check this tournament's partition.")
+@with_appcontext
+def check_indexes_command(tid):
+    """Check the hot queries use their indexes, using EXPLAIN."""
+    missing = 0
+    for description, indexes, used, plan in check_indexes(tid):
+        click.echo(f"{'ok  ' if used else 'MISS'} {description}: {' and '.join(indexes)}")
+        if not used:
+            missing += 1
+            for line in plan:
+                click.echo(f"       {line}")
+    if missing:
+        current_app.logger.warning(f"{missing} queries are not using their index")
+        raise SystemExit(1)
+
+
+def init_app(app):
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(check_indexes_command)
+    # Checked at startup too, but not enforced there so the CLI commands
+    # that fix the schema can still load the app
+    with app.app_context():
+        problem = schema_problem()
+    if problem is not None:
+        app.logger.error(problem)
+    app.before_request(check_schema)
@@ -0,0 +1,125 @@
+from flask import Response, current_app, stream_with_context
+from sqlalchemy.sql.expression import text
+from sass.cache import VersionedCache
+from sass.db_grabber import get_conn
+from sass.db_ops import get_players, get_tournament
+
+LINKS = [
+    {
+        "rel": "schemaderivedfrom",
+        "href": "http://steffens.org/nrtm/nrtm-schema.json",
+    },
+    {"rel": "uploadedfrom", "href": "https://github.com/Chemscribbler/sass"},
+]
+
+
+def load_export(tid):
+    """
+    Everything the export needs: the tournament, its standings and every
+    match, the matches in one query ordered by round and table
+    """
+    t = get_tournament(tid)
+    players = get_players(tid)
+    matches = (
+        get_conn(tid)
+        .execute(
+            text(
+                """
+                SELECT rnd, match_num, corp_id, runner_id, corp_score, runner_score
+                FROM match WHERE tid = :tid ORDER BY rnd, match_num
+                """
+            ),
+            {"tid": tid},
+        )
+        .fetchall()
+    )
+    rounds = {}
+    for m in matches:
+        rounds.setdefault(m["rnd"], []).append(tuple(m)[1:])
+    return t, players, rounds
+
+
+def player_entry(rank, player):
+    return {
+        "id": player["id"],
+        "name": player["name"],
+        "rank": rank,
+        "corpIdentity": player["corp_id"],
+        "runnerIdentity": player["runner_id"],
+        "matchPoints": player["score"],
+        "strengthOfSchedule": player["sos"],
+        "extendedStrengthOfSchedule": player["esos"],
+        "sideBalance": player["bias"],
+    }
+
+
+def match_entry(match_num, corp_id, runner_id, corp_score, runner_score):
+    return {
+        "table": match_num,
+        "corp": {"id": corp_id, "score": corp_score},
+        "runner": {"id": runner_id, "score": runner_score},
+    }
+
+
+def round_fragment(dumps, matches):
+    return dumps([match_entry(*m) for m in matches])
+
+
+def export(tid, cache=None):
+    """
+    Yields the NRTM JSON for the tournament piece by piece, keys sorted and
+    compact. The database is read up front, so a slow client doesn't hold a
+    connection.
+
+    A closed round's fragment is kept in cache next to the match rows it was
+    made from, and reused while the rows are unchanged, so only the current
+    round is serialized on each export.
+    """
+    t, players, rounds = load_export(tid)
+    dumps = current_app.json.dumps
+    last_rnd = max(rounds) if rounds else None
+
+    def compact(obj):
+        return dumps(obj, separators=(",", ":"))
+
+    def generate():
+        yield '{"cutToTop":0,"links":' + compact(LINKS)
+        yield ',"name":' + compact(t["title"])
+        yield ',"players":['
+        for rank, player in enumerate(players, start=1):
+            yield ("," if rank > 1 else "") + compact(player_entry(rank, player))
+        yield '],"preliminaryRounds":' + compact(last_rnd) + ',"rounds":['
+        for rnd in range(1, (last_rnd or 0) + 1):
+            matches = tuple(rounds.get(rnd, ()))
+            fragment = None
+            closed = rnd < t["current_rnd"]
+            if cache is not None and closed:
+                fragment = cache.get(("nrtm", tid, rnd, matches))
+            if fragment is None:
+                fragment = round_fragment(compact, matches)
+                if cache is not None and closed:
+                    cache.put(("nrtm", tid, rnd, matches), fragment)
+            yield ("," if rnd > 1 else "") + fragment
+        yield '],"uploadedFrom":"AesopsTables"}\n'
+
+    return generate()
+
+
+def get_round_cache():
+    return current_app.extensions["nrtm_rounds"]
+
+
+def export_response(tid):
+    """
+    Streams the export rather than building the whole document per request,
+    closed rounds come from the round fragment cache
+    """
+    return Response(
+        stream_with_context(export(tid, get_round_cache())), mimetype="application/json"
+    )
+
+
+def init_app(app):
+    # Not cleared on writes like the page cache: entries are only used while
+    # their round's matches are unchanged, old ones just age out
+    app.extensions["nrtm_rounds"] = VersionedCache(app.config.get("NRTM_ROUND_CACHE_SIZE", 1024))
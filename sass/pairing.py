@@ -0,0 +1,376 @@
+from random import random
+from threading import Event, Thread
+import time
+import numpy as np
+from sass.matching import BlossomMatcher
+from sass.exceptions import PairingException, PairingTimeout
+from sqlalchemy.sql.expression import text
+from sass.db_grabber import get_conn
+from sass.db_ops import ACTIVE_PLAYERS
+
+MATCH_HISTORY = "SELECT corp_id, runner_id FROM match WHERE tid = :tid"
+
+
+class PairingContext:
+    """
+    Everything make_pairings needs to know about a tournament, loaded once per round.
+    Players are kept in standings order and the match history is a set of
+    (corp_id, runner_id) tuples so side checks never go back to the database.
+    """
+
+    def __init__(self, plrs, history):
+        self.plrs = list(plrs)
+        self.players = {plr["id"]: plr for plr in self.plrs}
+        self.history = set(history)
+
+    @classmethod
+    def load(cls, tid):
+        conn = get_conn(tid)
+        plrs = conn.execute(text(ACTIVE_PLAYERS), {"tid": tid}).fetchall()
+        history = conn.execute(text(MATCH_HISTORY), {"tid": tid}).fetchall()
+        return cls(plrs, [(m["corp_id"], m["runner_id"]) for m in history])
+
+    def get_player(self, pid):
+        return self.players[pid]
+
+    def can_corp(self, p1, p2):
+        """
+        Same contract as tournament.can_corp, answered from the loaded history
+        0 if they haven't played, None if they've played both sides,
+        otherwise the ID of the player who has to Corp
+        """
+        p1_corped = (p1["id"], p2["id"]) in self.history
+        p2_corped = (p2["id"], p1["id"]) in self.history
+
+        if not p1_corped and not p2_corped:
+            return 0
+        elif not p1_corped:
+            return p1["id"]
+        elif not p2_corped:
+            return p2["id"]
+        else:
+            return None
+
+
+UNPAIRABLE = -(10**15)
+
+
+class CostMatrices:
+    """
+    Pairing weights for every pair of players in a PairingContext, as n x n arrays.
+    Row/column i is ctx.plrs[i]. Only the upper triangle (i < j) is filled in,
+    the same pairs as combinations(ctx.plrs, 2).
+
+    :corp_cost: side bias cost of the pairing (0 for byes)
+    :score_cost: calc_score_cost(score_i, score_j)
+    :weight: 1000 - (corp_cost + score_cost), the edge weight
+    :int_weight: 6 * weight, which is always a whole number and is what the matcher gets
+    :i_corps: True if player i takes the Corp side against player j
+    :valid: False if the pair can't be made (rematch on both sides, or a second bye)
+    """
+
+    def __init__(self, ids, score, is_bye, corp_cost, score_cost, i_corps, valid):
+        self.ids = ids
+        self.score = score
+        self.is_bye = is_bye
+        self.corp_cost = corp_cost
+        self.score_cost = score_cost
+        self.weight = 1000 - (corp_cost + score_cost)
+        diff = score[:, None] - score[None, :]
+        self.int_weight = 6000 - 6 * corp_cost - (diff + 1) * diff
+        self.i_corps = i_corps
+        self.valid = valid
+
+    def edges(self, window=None):
+        """
+        Returns parallel arrays (i, j, int_weight) for every valid pair, in combinations order
+
+        :window: if set, only pairs at most this many points apart (byes pair with anyone)
+        """
+        valid = self.valid
+        if window is not None:
+            in_window = np.abs(self.score[:, None] - self.score[None, :]) <= window
+            in_window |= self.is_bye[:, None] | self.is_bye[None, :]
+            valid = valid & in_window
+        rows, cols = np.nonzero(valid)
+        return rows.tolist(), cols.tolist(), self.int_weight[rows, cols].tolist()
+
+    def sides(self, i, j):
+        """
+        Returns (corp_player_id, runner_player_id) for the pair i, j
+        """
+        i, j = min(i, j), max(i, j)
+        if self.i_corps[i, j]:
+            return self.ids[i], self.ids[j]
+        return self.ids[j], self.ids[i]
+
+    def pair_weights(self):
+        """
+        Symmetric int_weight as nested lists, with UNPAIRABLE for pairs that can't be made
+        """
+        weight = np.where(self.valid, self.int_weight, UNPAIRABLE)
+        upper = np.triu(weight, 1)
+        return (upper + upper.T + np.diag([UNPAIRABLE] * len(self.ids))).tolist()
+
+    def total_cost(self, pairs):
+        """
+        Sum of corp cost and score cost over the given (i, j) pairs, lower is better
+        """
+        return sum(
+            self.corp_cost[min(i, j), max(i, j)] + self.score_cost[min(i, j), max(i, j)]
+            for i, j in pairs
+        )
+
+
+def corp_cost_matrix(bias):
+    """
+    Vectorised calc_corp_cost: entry [i, j] is the cost of player i corping against player j
+    """
+    p1 = bias[:, None]
+    p2 = bias[None, :]
+    init_max_bias = np.maximum(np.abs(p1), np.abs(p2))
+    prime_max_bias = np.maximum(np.abs(p1 + 1), np.abs(p2 - 1))
+    return (8 ** prime_max_bias) * (prime_max_bias >= init_max_bias)
+
+
+def score_cost_matrix(score):
+    """
+    Vectorised calc_score_cost: entry [i, j] is calc_score_cost(score[i], score[j])
+    """
+    diff = score[:, None] - score[None, :]
+    return (diff + 1) * diff / 6
+
+
+def build_cost_matrices(ctx):
+    """
+    Computes the same edges as get_side_tuple/calc_score_cost for every pair at once.
+    Ties in side cost are still settled with random.random(), drawn in
+    combinations order so a seeded run pairs exactly like the scalar code.
+    """
+    n = len(ctx.plrs)
+    ids = [plr["id"] for plr in ctx.plrs]
+    score = np.array([plr["score"] for plr in ctx.plrs], dtype=np.int64)
+    bias = np.array([plr["bias"] for plr in ctx.plrs], dtype=np.int64)
+    is_bye = np.array([bool(plr["is_bye"]) for plr in ctx.plrs])
+    received_bye = np.array([bool(plr["received_bye"]) for plr in ctx.plrs])
+
+    index = {pid: i for i, pid in enumerate(ids)}
+    corped = np.zeros((n, n), dtype=bool)
+    for corp_id, runner_id in ctx.history:
+        if corp_id in index and runner_id in index:
+            corped[index[corp_id], index[runner_id]] = True
+
+    upper = np.triu(np.ones((n, n), dtype=bool), 1)
+    cost = corp_cost_matrix(bias)
+    i_cost = cost
+    j_cost = cost.T
+
+    i_corped = corped
+    j_corped = corped.T
+    rematch = i_corped & j_corped
+    i_forced = j_corped & ~i_corped
+    free = ~i_corped & ~j_corped
+
+    i_corps = i_forced | (free & (i_cost < j_cost))
+    tie = upper & free & (i_cost == j_cost)
+
+    bye_pair = is_bye[:, None] | is_bye[None, :]
+    tie &= ~bye_pair
+    rows, cols = np.nonzero(tie)
+    flips = np.array([random() > 0.5 for _ in range(len(rows))], dtype=bool)
+    i_corps[rows, cols] = flips
+
+    corp_cost = np.where(i_corps, i_cost, j_cost)
+    valid = upper & ~rematch
+
+    bye_blocked = received_bye[:, None] | received_bye[None, :]
+    i_corps = np.where(bye_pair, True, i_corps)
+    corp_cost = np.where(bye_pair, 0, corp_cost)
+    valid = np.where(bye_pair, upper & ~bye_blocked, valid)
+
+    return CostMatrices(
+        ids,
+        score,
+        is_bye,
+        corp_cost,
+        score_cost_matrix(score),
+        i_corps,
+        valid,
+    )
+
+
+def match_players(costs, window=None, matcher=None, cancel=None):
+    """
+    Max weight, max cardinality matching over the cost matrices.
+    Returns a sorted list of (i, j) index pairs.
+
+    :matcher: a sass.matching.Matcher, defaults to BlossomMatcher
+    :cancel: optional threading.Event passed on to the matcher
+
+    With a window only players within that many match points of each other
+    get an edge (calc_score_cost grows with the gap, so these are the edges
+    the matching prefers anyway), which keeps the graph to each player's
+    nearby score groups instead of the whole field. If that leaves someone
+    unpaired the window is widened and the matching retried, ending at the
+    full graph.
+    """
+    if matcher is None:
+        matcher = BlossomMatcher()
+    n = len(costs.ids)
+    scores = costs.score[~costs.is_bye]
+    span = int(scores.max() - scores.min()) if len(scores) else 0
+    while True:
+        pairings = matcher.match(n, *costs.edges(window), cancel=cancel)
+        if window is None or len(pairings) == n // 2 or window >= span:
+            return pairings
+        window = window * 2 + 1
+
+
+def greedy_pairs(weight):
+    """
+    Goes down the standings and gives each unpaired player the best partner left.
+    Returns (pairs, unpaired)
+    """
+    n = len(weight)
+    paired = [False] * n
+    pairs = []
+    for i in range(n):
+        if paired[i]:
+            continue
+        best = -1
+        for j in range(i + 1, n):
+            if not paired[j] and weight[i][j] != UNPAIRABLE:
+                if best == -1 or weight[i][j] > weight[i][best]:
+                    best = j
+        if best != -1:
+            paired[i] = paired[best] = True
+            pairs.append((i, best))
+    return pairs, [i for i in range(n) if not paired[i]]
+
+
+def improve_pairs(weight, pairs, unpaired, should_stop):
+    """
+    Local search over a matching, in place, until nothing improves or should_stop() is true.
+    Leftover players are first paired with each other or swapped into an
+    existing pair, then pairs are re-split two at a time (2-opt) whenever that
+    raises the total weight.
+    """
+    improved = True
+    while improved and not should_stop():
+        improved = False
+        for u in list(unpaired):
+            if u not in unpaired:
+                continue
+            for v in unpaired:
+                if v != u and weight[u][v] != UNPAIRABLE:
+                    pairs.append((u, v))
+                    unpaired.remove(u)
+                    unpaired.remove(v)
+                    improved = True
+                    break
+            else:
+                for v in unpaired:
+                    if v == u:
+                        continue
+                    for x, (a, b) in enumerate(pairs):
+                        for c, d in ((a, b), (b, a)):
+                            if weight[u][c] != UNPAIRABLE and weight[v][d] != UNPAIRABLE:
+                                pairs[x] = (u, c)
+                                pairs.append((v, d))
+                                unpaired.remove(u)
+                                unpaired.remove(v)
+                                improved = True
+                                break
+                        if u not in unpaired:
+                            break
+                    if u not in unpaired:
+                        break
+
+        for x in range(len(pairs)):
+            if should_stop():
+                return
+            for y in range(x + 1, len(pairs)):
+                a, b = pairs[x]
+                c, d = pairs[y]
+                current = weight[a][b] + weight[c][d]
+                if weight[a][c] + weight[b][d] > current:
+                    pairs[x], pairs[y] = (a, c), (b, d)
+                    improved = True
+                elif weight[a][d] + weight[b][c] > current:
+                    pairs[x], pairs[y] = (a, d), (b, c)
+                    improved = True
+
+
+def fill_pairs(costs, pairs, unpaired):
+    """
+    Pairs whoever the heuristic couldn't, cheapest pair first, even if that
+    means a rematch or a second bye. Returns the number of such forced pairs.
+    """
+    forced = 0
+    while len(unpaired) > 1:
+        i, j = max(
+            ((i, j) for x, i in enumerate(unpaired) for j in unpaired[x + 1 :]),
+            key=lambda pair: costs.int_weight[min(pair), max(pair)],
+        )
+        pairs.append((i, j))
+        unpaired.remove(i)
+        unpaired.remove(j)
+        forced += 1
+    return forced
+
+
+def anytime_match(costs, budget, window=None, matcher=None):
+    """
+    Pairing with a time budget in seconds. Returns (pairs, exact, forced).
+
+    The exact matcher runs on a worker thread while a greedy matching is
+    built and improved by improve_pairs. If the exact result is ready by the
+    deadline it is used and exact is True, otherwise the worker is cancelled
+    and the best heuristic matching is returned. Anyone left unpaired either
+    way is paired by fill_pairs, forced counting those pairs, so this never
+    waits past the deadline for long.
+
+    The matcher has to be cancellable, or it would keep running (and holding
+    the GIL) after the deadline.
+    """
+    if matcher is None:
+        matcher = BlossomMatcher()
+    if not matcher.cancellable:
+        raise PairingException(
+            f"The {matcher.name} matcher can't be stopped at the deadline, use one "
+            "that can with PAIRING_TIME_BUDGET"
+        )
+    deadline = time.monotonic() + budget
+    cancel = Event()
+    result = {}
+
+    def run_exact():
+        try:
+            result["pairs"] = match_players(costs, window, matcher, cancel)
+        except PairingTimeout:
+            pass
+        except Exception as e:
+            result["error"] = e
+
+    worker = Thread(target=run_exact, daemon=True)
+    worker.start()
+
+    weight = costs.pair_weights()
+    pairs, unpaired = greedy_pairs(weight)
+    improve_pairs(
+        weight,
+        pairs,
+        unpaired,
+        lambda: time.monotonic() >= deadline or not worker.is_alive(),
+    )
+    worker.join(max(0, deadline - time.monotonic()))
+    cancel.set()
+    if "error" in result:
+        raise result["error"]
+    exact = "pairs" in result
+    if exact:
+        pairs = list(result["pairs"])
+        paired = {i for pair in pairs for i in pair}
+        unpaired = [i for i in range(len(costs.ids)) if i not in paired]
+    forced = fill_pairs(costs, pairs, unpaired)
+    return sorted(tuple(sorted(pair)) for pair in pairs), exact, forced
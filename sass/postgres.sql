@@ -1,3 +1,8 @@
+DROP TABLE IF EXISTS schema_version;
+DROP TABLE IF EXISTS job;
+DROP TABLE IF EXISTS meta_summary;
+DROP TABLE IF EXISTS meta_monthly;
+DROP TABLE IF EXISTS standings_snapshot;
 DROP TABLE IF EXISTS match;
 DROP TABLE IF EXISTS player;
 DROP TABLE IF EXISTS tournament;
@@ -7,6 +12,8 @@ CREATE TABLE tournament (
     title TEXT UNIQUE NOT NULL,
     t_date TIMESTAMP NOT NULL,
     current_rnd INTEGER DEFAULT 0,
+    data_version INTEGER NOT NULL DEFAULT 0,
+    meta_version INTEGER NOT NULL DEFAULT 0,
     active BOOLEAN DEFAULT true    
 );
 
@@ -40,3 +47,67 @@ CREATE TABLE match (
     FOREIGN KEY (corp_id) REFERENCES player (id),
     FOREIGN KEY (runner_id) REFERENCES player (id)
 );
+
+CREATE TABLE standings_snapshot (
+    tid INTEGER NOT NULL,
+    rnd INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    pid INTEGER NOT NULL,
+    score INTEGER,
+    sos REAL,
+    esos REAL,
+    bias INTEGER,
+    corp_points INTEGER DEFAULT 0,
+    runner_points INTEGER DEFAULT 0,
+    PRIMARY KEY (tid, rnd, rank),
+    FOREIGN KEY (tid) REFERENCES tournament (id),
+    FOREIGN KEY (pid) REFERENCES player (id)
+);
+
+CREATE TABLE meta_summary (
+    tid INTEGER NOT NULL,
+    corp_identity TEXT NOT NULL,
+    runner_identity TEXT NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    corp_wins INTEGER NOT NULL DEFAULT 0,
+    runner_wins INTEGER NOT NULL DEFAULT 0,
+    ties INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (tid, corp_identity, runner_identity),
+    FOREIGN KEY (tid) REFERENCES tournament (id)
+);
+
+CREATE TABLE meta_monthly (
+    month TEXT NOT NULL,
+    corp_identity TEXT NOT NULL,
+    runner_identity TEXT NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    corp_wins INTEGER NOT NULL DEFAULT 0,
+    runner_wins INTEGER NOT NULL DEFAULT 0,
+    ties INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, corp_identity, runner_identity)
+);
+
+CREATE TABLE job (
+    tid INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    message TEXT,
+    next_url TEXT,
+    created DOUBLE PRECISION NOT NULL,
+    finished DOUBLE PRECISION,
+    FOREIGN KEY (tid) REFERENCES tournament (id)
+);
+
+CREATE INDEX ix_match_tid_rnd ON match (tid, rnd);
+CREATE INDEX ix_match_corp_runner ON match (corp_id, runner_id);
+CREATE INDEX ix_match_runner_corp ON match (runner_id, corp_id);
+CREATE INDEX ix_player_tid_active ON player (tid, active);
+CREATE INDEX ix_player_tid_is_bye ON player (tid, is_bye);
+CREATE INDEX ix_meta_summary_corp ON meta_summary (corp_identity, tid);
+CREATE INDEX ix_meta_summary_runner ON meta_summary (runner_identity, tid);
+CREATE INDEX ix_meta_monthly_corp ON meta_monthly (corp_identity, month);
+CREATE INDEX ix_meta_monthly_runner ON meta_monthly (runner_identity, month);
+CREATE INDEX ix_tournament_meta_version ON tournament (meta_version);
+CREATE INDEX ix_tournament_date ON tournament (t_date);
+CREATE INDEX ix_tournament_active_id ON tournament (active, id);
+CREATE INDEX ix_tournament_title ON tournament (lower(title));
@@ -0,0 +1,244 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import click
+from flask import current_app, g, request, send_file, session
+from flask.cli import with_appcontext
+from sqlalchemy.sql.expression import text
+from werkzeug.exceptions import NotFound
+from sass.cache import tournament_version
+from sass.db_grabber import get_conn
+from sass.db_ops import get_rnd_list, get_tournament
+from sass.signals import tournament_changed
+
+# What each round's pairings page shows of its matches
+PAGE_MATCHES = """
+    SELECT match.rnd, match.id, match.match_num, match.corp_score, match.runner_score,
+    corp_plr.p_name AS corp_player, runner_plr.p_name AS runner_player
+    FROM match
+    LEFT JOIN player corp_plr
+    ON match.corp_id = corp_plr.id
+    LEFT JOIN player runner_plr
+    ON match.runner_id = runner_plr.id
+    WHERE match.tid = :tid
+    ORDER BY match.rnd, match.match_num
+"""
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def publish_dir():
+    path = current_app.config.get("STATIC_PUBLISH_DIR") or os.path.join(
+        current_app.instance_path, "published"
+    )
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def page_path(tid, rnd=None):
+    """
+    Laid out like the URLs, /<tid> is <tid>/index.html and /<tid>/<rnd> is
+    <tid>/<rnd>/index.html, each next to an index.html.gz
+    """
+    if rnd is None:
+        return os.path.join(publish_dir(), str(tid), "index.html")
+    return os.path.join(publish_dir(), str(tid), str(rnd), "index.html")
+
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.chmod(tmp, 0o644)
+    os.replace(tmp, path)
+
+
+def write_page(path, html):
+    data = html.encode("utf-8")
+    # Written before the page itself, so a server preferring the .gz never
+    # sends a compressed copy older than the plain one
+    write_atomic(path + ".gz", gzip.compress(data, 9, mtime=0))
+    write_atomic(path, data)
+
+
+@contextmanager
+def publish_lock(tid):
+    """
+    Workers publishing the same tournament take turns, across processes too
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(publish_dir(), f".{tid}.lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def published_version(root):
+    try:
+        with open(os.path.join(root, "version")) as f:
+            return int(f.read())
+    except (FileNotFoundError, ValueError):
+        return -1
+
+
+def published_signatures(root):
+    try:
+        with open(os.path.join(root, "rounds.json")) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def round_signatures(tid):
+    """
+    A digest per round of what its pairings page shows: the round's matches
+    and players' names, and the title, current round and round list in the
+    header. The page's data_version only tells the live updates where to
+    start, a page published at an older one gets the current table on
+    connecting, so it is left out.
+    """
+    t = get_tournament(tid)
+    rounds = [r["rnds"] for r in get_rnd_list(tid)]
+    layout = repr((t["title"], t["current_rnd"], rounds))
+    digests = {rnd: hashlib.sha1(layout.encode()) for rnd in rounds}
+    for row in get_conn(tid).execute(text(PAGE_MATCHES), {"tid": tid}):
+        digests[row["rnd"]].update(repr(tuple(row)[1:]).encode())
+    return {str(rnd): digest.hexdigest() for rnd, digest in digests.items()}
+
+
+def publish(tid, force=False):
+    """
+    Renders the tournament's standings, and the pairings of the rounds whose
+    page changed since the last publish, to disk, and removes the pages of
+    rounds that no longer exist. Skipped if another worker already published
+    this data_version or a later one. force renders every page.
+    """
+    from sass.manager import render_pairings, render_standings
+
+    root = os.path.join(publish_dir(), str(tid))
+    with current_app.test_request_context(f"/{tid}"), publish_lock(tid):
+        try:
+            version = tournament_version(tid)
+        except NotFound:
+            shutil.rmtree(root, ignore_errors=True)
+            return
+        if not force and published_version(root) >= version:
+            return
+        write_page(page_path(tid), render_standings(tid))
+        previous = {} if force else published_signatures(root)
+        signatures = round_signatures(tid)
+        for rnd, signature in signatures.items():
+            path = page_path(tid, int(rnd))
+            if previous.get(rnd) != signature or not os.path.exists(path):
+                write_page(path, render_pairings(tid, int(rnd)))
+        for name in os.listdir(root):
+            if name.isdigit() and name not in signatures:
+                shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        write_atomic(os.path.join(root, "rounds.json"), json.dumps(signatures).encode())
+        write_atomic(os.path.join(root, "version"), str(version).encode())
+
+
+class PublishQueue:
+    """
+    Publishes on a worker thread once the request that changed the
+    tournament is done, so the TO reporting a result doesn't wait on the
+    rendering. A tournament is queued at most once, changes made while it
+    waits are picked up by that publish.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.inline = not app.config.get("BACKGROUND_JOBS", True)
+        self.executor = None if self.inline else ThreadPoolExecutor(max_workers=1)
+        self.queued = set()
+        self.lock = threading.Lock()
+
+    def submit(self, tid):
+        if self.inline:
+            self._run(tid)
+            return
+        with self.lock:
+            if tid in self.queued:
+                return
+            self.queued.add(tid)
+        self.executor.submit(self._run, tid)
+
+    def _run(self, tid):
+        with self.lock:
+            self.queued.discard(tid)
+        with self.app.app_context():
+            try:
+                publish(tid)
+            except Exception:
+                current_app.logger.exception(f"could not publish tournament {tid}")
+
+
+def schedule_publish(sender, tid, **kwargs):
+    # A request can commit several times, publish once when it's done
+    g.setdefault("publish_pending", set()).add(tid)
+
+
+def publish_pending(exc=None):
+    pending = g.pop("publish_pending", set())
+    for tid in sorted(pending):
+        current_app.extensions["publisher"].submit(tid)
+
+
+def serve_published():
+    """
+    With STATIC_SERVE, public pages are sent straight from the published
+    files, gzipped if the client takes it. Without published files the view
+    runs as usual, and also when there are flashed messages to show, which
+    the published pages don't have. A front proxy can do the same, e.g.
+    nginx's try_files $uri/index.html @app with gzip_static on.
+    """
+    if request.method != "GET" or request.endpoint not in ("manager.main", "manager.pairings"):
+        return None
+    if session.get("_flashes"):
+        return None
+    path = page_path(request.view_args["tid"], request.view_args.get("rnd"))
+    if not os.path.exists(path):
+        return None
+    if "gzip" in request.accept_encodings and os.path.exists(path + ".gz"):
+        response = send_file(path + ".gz", mimetype="text/html", conditional=True)
+        response.headers["Content-Encoding"] = "gzip"
+        response.vary.add("Accept-Encoding")
+        return response
+    return send_file(path, mimetype="text/html", conditional=True)
+
+
+@click.command("publish-static")
+@click.option("--tid", type=int, default=None, help="Only publish this tournament.")
+@with_appcontext
+def publish_static_command(tid):
+    """Render the public pages of every tournament to STATIC_PUBLISH_DIR."""
+    from sass.db_ops import get_tournaments
+
+    tids = [tid] if tid is not None else [t["id"] for t in get_tournaments()]
+    for t in tids:
+        publish(t, force=True)
+    click.echo(f"published {len(tids)} tournaments to {publish_dir()}")
+
+
+def init_app(app):
+    app.cli.add_command(publish_static_command)
+    if app.config.get("STATIC_PUBLISH", False):
+        app.extensions["publisher"] = PublishQueue(app)
+        tournament_changed.connect(schedule_publish, app)
+        app.teardown_appcontext(publish_pending)
+    if app.config.get("STATIC_SERVE", False):
+        app.before_request(serve_published)
@@ -0,0 +1,147 @@
+import csv
+import io
+import json
+import click
+from flask.cli import with_appcontext
+from sqlalchemy.sql.expression import text
+from werkzeug.exceptions import NotFound
+from sass.db_grabber import get_conn
+from sass.db_ops import add_players, get_tournament
+from sass.identities import get_catalog
+
+# Roster columns, with the other names they're accepted under
+COLUMNS = {
+    "name": ("name", "player", "p_name"),
+    "corp_id": ("corp_id", "corp"),
+    "runner_id": ("runner_id", "runner"),
+}
+NO_ID = ("", "-")
+
+
+class RosterError(ValueError):
+    pass
+
+
+def decode_roster(raw):
+    try:
+        return raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise RosterError("The roster file isn't UTF-8 text, save it as UTF-8 and try again")
+
+
+def parse_roster(data, fmt):
+    """
+    Rows of a CSV (with a header row) or JSON (a list of objects) roster as
+    dicts with COLUMNS' keys
+    """
+    if fmt == "json":
+        try:
+            entries = json.loads(data)
+        except ValueError as e:
+            raise RosterError(f"Not valid JSON: {e}")
+        if isinstance(entries, dict):
+            entries = entries.get("players")
+        if not isinstance(entries, list) or not all(isinstance(e, dict) for e in entries):
+            raise RosterError('A JSON roster is a list of {"name", "corp_id", "runner_id"} objects')
+    else:
+        entries = list(csv.DictReader(io.StringIO(data)))
+    rows = []
+    for entry in entries:
+        fields = {str(key).strip().lower(): value for key, value in entry.items() if key is not None}
+        rows.append(
+            {
+                column: str(next((fields[a] for a in aliases if fields.get(a) is not None), "")).strip()
+                for column, aliases in COLUMNS.items()
+            }
+        )
+    return rows
+
+
+def check_identity(name, side):
+    """
+    The catalog's spelling of the identity, None for no identity, raises
+    RosterError for an unknown one or one of the wrong side
+    """
+    if name in NO_ID:
+        return None
+    card = get_catalog().lookup(name)
+    if card is None:
+        raise RosterError(f"Unknown identity {name!r}")
+    if card["side"] != side:
+        raise RosterError(f"{card['name']} is not a {side} identity")
+    return card["name"]
+
+
+def validate_roster(tid, rows):
+    """
+    Returns (players, errors), players being the (name, corp_id, runner_id)
+    to add and errors one {"row", "name", "error"} per rejected row. Row
+    numbers count from 1 and skip a CSV's header. Names already in the
+    tournament or earlier in the roster are rejected as duplicates.
+    """
+    existing = {
+        " ".join(row["p_name"].split()).casefold()
+        for row in get_conn(tid).execute(
+            text("SELECT p_name FROM player WHERE tid = :tid AND is_bye = false"), {"tid": tid}
+        )
+    }
+    players = []
+    errors = []
+    for number, row in enumerate(rows, start=1):
+        name = " ".join(row["name"].split())
+        try:
+            if not name:
+                raise RosterError("No name")
+            if name.casefold() in existing:
+                raise RosterError("Duplicate player")
+            corp_id = check_identity(row["corp_id"], "corp")
+            runner_id = check_identity(row["runner_id"], "runner")
+        except RosterError as e:
+            errors.append({"row": number, "name": name, "error": str(e)})
+            continue
+        existing.add(name.casefold())
+        players.append((name, corp_id, runner_id))
+    return players, errors
+
+
+def import_roster(tid, data, fmt, dry_run=False):
+    """
+    Adds every valid row of the roster to the tournament in one insert and
+    reports the ones that weren't, see validate_roster. With dry_run nothing
+    is added.
+    """
+    get_tournament(tid)
+    players, errors = validate_roster(tid, parse_roster(data, fmt))
+    added = 0 if dry_run else add_players(tid, players)
+    return {"added": added, "valid": len(players), "errors": errors}
+
+
+def roster_format(filename, content_type=None):
+    if (filename or "").lower().endswith(".json") or "json" in (content_type or ""):
+        return "json"
+    return "csv"
+
+
+@click.command("import-players")
+@click.argument("tid", type=int)
+@click.argument("roster", type=click.File("r", encoding="utf-8-sig"))
+@click.option("--dry-run", is_flag=True, help="Only check the roster.")
+@with_appcontext
+def import_players_command(tid, roster, dry_run):
+    """Add the players in a CSV or JSON roster file to a tournament."""
+    try:
+        report = import_roster(tid, roster.read(), roster_format(roster.name), dry_run)
+    except RosterError as e:
+        raise click.ClickException(str(e))
+    except NotFound:
+        raise click.ClickException(f"Tournament id {tid} does not exist")
+    for error in report["errors"]:
+        click.echo(f"row {error['row']} ({error['name'] or 'no name'}): {error['error']}", err=True)
+    if dry_run:
+        click.echo(f"{report['valid']} players would be added, {len(report['errors'])} rows rejected")
+    else:
+        click.echo(f"added {report['added']} players, {len(report['errors'])} rows rejected")
+
+
+def init_app(app):
+    app.cli.add_command(import_players_command)
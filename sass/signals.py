@@ -0,0 +1,7 @@
+from blinker import Namespace
+
+signals = Namespace()
+
+# Sent with tid= after a committed write changes a tournament's data, once
+# its data_version has been bumped
+tournament_changed = signals.signal("tournament-changed")
@@ -0,0 +1,267 @@
+from sqlalchemy.sql.expression import bindparam, text
+
+# The matches either side of some players, each half answered from
+# ix_match_corp_runner or ix_match_runner_corp
+PLAYER_MATCHES = """
+    SELECT id, corp_id, runner_id, corp_score, runner_score FROM match WHERE corp_id IN :pids
+    UNION
+    SELECT id, corp_id, runner_id, corp_score, runner_score FROM match WHERE runner_id IN :pids
+    ORDER BY id
+"""
+
+PLAYERS_BY_ID = """
+    SELECT id, is_bye, score, bias, games_played, sos, esos, received_bye
+    FROM player WHERE id IN :pids
+"""
+
+
+def load_standings_state(conn, tid):
+    """
+    Reads everything the standings depend on: every player in the tournament
+    and every match they've played, one query each.
+    """
+    players = conn.execute(
+        text(
+            """
+            SELECT id, is_bye, score, bias, games_played, sos, esos, received_bye
+            FROM player WHERE tid = :tid
+            """
+        ),
+        {"tid": tid},
+    ).fetchall()
+    matches = conn.execute(
+        text(
+            """
+            SELECT corp_id, runner_id, corp_score, runner_score
+            FROM match WHERE tid = :tid ORDER BY id
+            """
+        ),
+        {"tid": tid},
+    ).fetchall()
+    return {plr["id"]: dict(plr) for plr in players}, matches
+
+
+def load_neighbourhood(conn, pids, depth):
+    """
+    The players within depth matches of pids, and every match played by the
+    ones less than depth away, by player id instead of reading the whole
+    tournament. Matches come back in id order like load_standings_state's.
+    """
+    matches = {}
+    known = set(pids)
+    frontier = set(pids)
+    for _ in range(depth):
+        if not frontier:
+            break
+        found = conn.execute(
+            text(PLAYER_MATCHES).bindparams(bindparam("pids", expanding=True)),
+            {"pids": sorted(frontier)},
+        ).fetchall()
+        reached = set()
+        for m in found:
+            matches[m["id"]] = m
+            reached.update((m["corp_id"], m["runner_id"]))
+        frontier = reached - known
+        known |= reached
+    players = conn.execute(
+        text(PLAYERS_BY_ID).bindparams(bindparam("pids", expanding=True)),
+        {"pids": sorted(known)},
+    ).fetchall()
+    return {plr["id"]: dict(plr) for plr in players}, [matches[mid] for mid in sorted(matches)]
+
+
+def compute_standings(players, matches, reset=False):
+    """
+    Recomputes score, bias, games_played, SOS, ESOS and received_bye in one pass over the matches.
+    players is {pid: row dict} and is updated in place.
+
+    Same rules as the old per-stat SQL:
+    - score counts every match, byes included; bye players keep their score
+    - bias and games_played only count matches between two real players
+    - SOS is total opponent score over total opponent games played, across
+      matches against real players, rounded to 3 places; ESOS is the same
+      over opponent SOS, rounded to 4 places
+    - a player with no qualifying matches keeps their stored value, unless
+      reset is set, in which case real players start again from zero and
+      without a bye
+    """
+    if reset:
+        for plr in players.values():
+            if not plr["is_bye"]:
+                plr.update(score=0, bias=0, games_played=0, sos=0, esos=0, received_bye=False)
+    points = {}
+    corp_games = {}
+    runner_games = {}
+    played = set()
+    corp_opponents = {}
+    runner_opponents = {}
+    for m in matches:
+        corp_id, runner_id = m["corp_id"], m["runner_id"]
+        if corp_id not in players or runner_id not in players:
+            continue
+        points[corp_id] = points.get(corp_id, 0) + (m["corp_score"] or 0)
+        points[runner_id] = points.get(runner_id, 0) + (m["runner_score"] or 0)
+
+        corp_bye = players[corp_id]["is_bye"]
+        runner_bye = players[runner_id]["is_bye"]
+        if corp_bye:
+            players[runner_id]["received_bye"] = True
+        if runner_bye:
+            players[corp_id]["received_bye"] = True
+        if corp_bye or runner_bye:
+            continue
+        corp_games[corp_id] = corp_games.get(corp_id, 0) + 1
+        runner_games[runner_id] = runner_games.get(runner_id, 0) + 1
+        played.update((corp_id, runner_id))
+        corp_opponents.setdefault(corp_id, []).append(runner_id)
+        runner_opponents.setdefault(runner_id, []).append(corp_id)
+
+    for pid, score in points.items():
+        if not players[pid]["is_bye"]:
+            players[pid]["score"] = int(score)
+    for pid in played:
+        players[pid]["bias"] = corp_games.get(pid, 0) - runner_games.get(pid, 0)
+        players[pid]["games_played"] = corp_games.get(pid, 0) + runner_games.get(pid, 0)
+    for pid in played:
+        players[pid]["sos"] = round(
+            opponent_average(pid, players, corp_opponents, runner_opponents, "score"), 3
+        )
+    for pid in played:
+        players[pid]["esos"] = round(
+            opponent_average(pid, players, corp_opponents, runner_opponents, "sos"), 4
+        )
+    return players
+
+
+def opponent_average(pid, players, corp_opponents, runner_opponents, stat):
+    """
+    Total of an opponent stat over total opponent games played.
+    Sums per side and then across sides, collapsing identical side totals,
+    the way the old UNION query did, so floats round the same way. Each
+    side is added up in opponent id order, the order that query reads a
+    player's matches through ix_match_runner_corp and ix_match_corp_runner.
+    """
+    sides = []
+    for opps in (runner_opponents.get(pid), corp_opponents.get(pid)):
+        if opps:
+            opps = sorted(opps)
+            sides.append(
+                (
+                    sum(players[o]["games_played"] or 0 for o in opps),
+                    sum(players[o][stat] or 0 for o in opps),
+                )
+            )
+    if len(sides) == 2 and sides[0] == sides[1]:
+        sides.pop()
+    games = sum(side[0] for side in sides)
+    total = sum(side[1] for side in sides)
+    return total / max(games, 1)
+
+
+def write_standings(conn, players):
+    """
+    Writes the computed stats back for every player in one executemany
+    """
+    if not players:
+        return
+    conn.execute(
+        text(
+            """
+            UPDATE player SET score = :score, bias = :bias, games_played = :games_played,
+            sos = :sos, esos = :esos, received_bye = :received_bye
+            WHERE id = :id
+            """
+        ),
+        [
+            {
+                "id": pid,
+                "score": plr["score"],
+                "bias": plr["bias"],
+                "games_played": plr["games_played"],
+                "sos": plr["sos"],
+                "esos": plr["esos"],
+                "received_bye": bool(plr["received_bye"]),
+            }
+            for pid, plr in players.items()
+        ],
+    )
+
+
+def update_standings(conn, tid, reset=False):
+    players, matches = load_standings_state(conn, tid)
+    write_standings(conn, compute_standings(players, matches, reset))
+
+
+def apply_result(conn, tid, corp_id, runner_id, old_result, new_result):
+    """
+    Provisional standings update for one reported (or re-reported) result,
+    so standings move as results come in instead of only at close_round.
+
+    old_result and new_result are (corp_score, runner_score), old being
+    (None, None) for a first report. Score changes by the difference, and a
+    first report between two real players also counts the game for side
+    bias. SOS is then recomputed for both players' opponents and ESOS one
+    step further out; nobody else is written. close_round still does the full
+    recompute, which these deltas agree with once every result is in.
+    """
+    apply_results(conn, tid, [(corp_id, runner_id, old_result, new_result)])
+
+
+def apply_results(conn, tid, results):
+    """
+    apply_result for many (corp_id, runner_id, old_result, new_result) at
+    once, loading the standings state once and writing each changed player
+    once. Gives the same standings as applying them one at a time.
+
+    Only the reported players' neighbourhood is read: ESOS changes up to two
+    matches away, and needs the SOS of opponents one further out.
+    """
+    players, matches = load_neighbourhood(
+        conn, {pid for result in results for pid in result[:2]}, 3
+    )
+    reported = set()
+    for corp_id, runner_id, old_result, new_result in results:
+        corp, runner = players[corp_id], players[runner_id]
+        is_bye_match = corp["is_bye"] or runner["is_bye"]
+        for plr, old, new in (
+            (corp, old_result[0], new_result[0]),
+            (runner, old_result[1], new_result[1]),
+        ):
+            if not plr["is_bye"]:
+                plr["score"] = (plr["score"] or 0) + new - (old or 0)
+        if old_result[0] is None and not is_bye_match:
+            corp["bias"] = (corp["bias"] or 0) + 1
+            runner["bias"] = (runner["bias"] or 0) - 1
+            corp["games_played"] = (corp["games_played"] or 0) + 1
+            runner["games_played"] = (runner["games_played"] or 0) + 1
+        reported.update((corp_id, runner_id))
+    if not reported:
+        return
+
+    corp_opponents = {}
+    runner_opponents = {}
+    for m in matches:
+        c, r = m["corp_id"], m["runner_id"]
+        if c in players and r in players and not (players[c]["is_bye"] or players[r]["is_bye"]):
+            corp_opponents.setdefault(c, []).append(r)
+            runner_opponents.setdefault(r, []).append(c)
+
+    def neighbours(pids):
+        found = set()
+        for pid in pids:
+            found.update(corp_opponents.get(pid, ()))
+            found.update(runner_opponents.get(pid, ()))
+        return found
+
+    sos_changed = neighbours(reported)
+    esos_changed = sos_changed | neighbours(sos_changed)
+    for pid in sos_changed:
+        players[pid]["sos"] = round(
+            opponent_average(pid, players, corp_opponents, runner_opponents, "score"), 3
+        )
+    for pid in esos_changed:
+        players[pid]["esos"] = round(
+            opponent_average(pid, players, corp_opponents, runner_opponents, "sos"), 4
+        )
+    changed = esos_changed | reported
+    write_standings(conn, {pid: players[pid] for pid in changed})
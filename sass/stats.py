@@ -0,0 +1,127 @@
+from flask import current_app
+from sass.cache import VersionedCache, cached
+from sass.db_ops import get_stats
+from sass.identities import get_catalog
+
+UNKNOWN = "Unknown"
+
+
+def identity_name(name):
+    return name if name and name != "-" else UNKNOWN
+
+
+def faction_of(name):
+    card = get_catalog().get(name)
+    return card["faction"] if card is not None else UNKNOWN
+
+
+def round_tally(groups):
+    """
+    Adds up one round's (corp identity, runner identity, games, corp wins,
+    runner wins, ties) groups per identity, per faction and per matchup.
+    Tallies are [games, wins, losses, ties] from that side's point of view.
+    """
+    tally = {"corp": {}, "runner": {}, "corp_factions": {}, "runner_factions": {}, "matchups": {}}
+    for corp, runner, games, corp_wins, runner_wins, ties in groups:
+        corp, runner = identity_name(corp), identity_name(runner)
+        for kind, key, wins, losses in (
+            ("corp", corp, corp_wins, runner_wins),
+            ("runner", runner, runner_wins, corp_wins),
+            ("corp_factions", faction_of(corp), corp_wins, runner_wins),
+            ("runner_factions", faction_of(runner), runner_wins, corp_wins),
+            ("matchups", (corp, runner), corp_wins, runner_wins),
+        ):
+            add(tally[kind].setdefault(key, [0, 0, 0, 0]), (games, wins, losses, ties))
+    return tally
+
+
+def add(total, counts):
+    for i, n in enumerate(counts):
+        total[i] += int(n or 0)
+
+
+def ranked(tallies, identities=False):
+    """
+    One row per identity or faction, most played first
+    """
+    rows = []
+    for name, (games, wins, losses, ties) in tallies.items():
+        row = {
+            "name": name,
+            "games": games,
+            "wins": wins,
+            "losses": losses,
+            "ties": ties,
+            "win_rate": round(wins / games, 3) if games else 0.0,
+        }
+        if identities:
+            row["faction"] = faction_of(name)
+        rows.append(row)
+    return sorted(rows, key=lambda row: (-row["games"], row["name"]))
+
+
+def compute_stats(tid):
+    """
+    Per identity and per faction win rates for each side, and the corp
+    against runner identity matchup table, over every reported result
+    between real players.
+
+    Each round's tally is kept next to the aggregate rows it was made from
+    and reused while those are unchanged, so after a result comes in only
+    that round is tallied again.
+    """
+    rounds = {}
+    for row in get_stats(tid):
+        rounds.setdefault(row["rnd"], []).append(tuple(row)[1:])
+    cache = current_app.extensions["stats_rounds"]
+    totals = {"corp": {}, "runner": {}, "corp_factions": {}, "runner_factions": {}, "matchups": {}}
+    for rnd, groups in rounds.items():
+        key = ("stats", tid, rnd, tuple(groups))
+        tally = cache.get(key)
+        if tally is None:
+            tally = round_tally(groups)
+            cache.put(key, tally)
+        for kind, entries in tally.items():
+            for name, counts in entries.items():
+                add(totals[kind].setdefault(name, [0, 0, 0, 0]), counts)
+    return dict(summarize(totals), rounds=sorted(rounds))
+
+
+def summarize(totals):
+    """
+    Ranked identity and faction rows and the matchup table, from tallies
+    added up the way round_tally makes them
+    """
+    corps = ranked(totals["corp"], identities=True)
+    runners = ranked(totals["runner"], identities=True)
+    matchups = {}
+    for (corp, runner), (games, corp_wins, runner_wins, ties) in totals["matchups"].items():
+        matchups.setdefault(corp, {})[runner] = {
+            "games": games,
+            "corp_wins": corp_wins,
+            "runner_wins": runner_wins,
+            "ties": ties,
+        }
+    return {
+        "games": sum(counts[0] for counts in totals["corp"].values()),
+        "corp": corps,
+        "runner": runners,
+        "corp_factions": ranked(totals["corp_factions"]),
+        "runner_factions": ranked(totals["runner_factions"]),
+        "matchups": {
+            "corps": [row["name"] for row in corps],
+            "runners": [row["name"] for row in runners],
+            "results": matchups,
+        },
+    }
+
+
+def tournament_stats(tid):
+    """
+    compute_stats, cached per tournament data_version like the public pages
+    """
+    return cached("stats", tid, None, lambda: compute_stats(tid))
+
+
+def init_app(app):
+    app.extensions["stats_rounds"] = VersionedCache(app.config.get("STATS_ROUND_CACHE_SIZE", 1024))
@@ -1,85 +1,143 @@
 from copy import copy
 from sqlalchemy.sql.expression import insert, text, select, update
-from sass.db_ops import get_db, get_tournament, get_active_players, get_player, metadata
-from networkx import Graph, max_weight_matching
-from itertools import combinations
+from sass.db_ops import (
+    get_tournament,
+    get_active_players,
+    get_player,
+    metadata,
+    save_standings_snapshot,
+)
 from random import random
-from json import load, dump
-import requests
-import os.path
-from sass.exceptions import PairingException
-from sass.db_grabber import get_db, metadata
+from sass.exceptions import AdminException, PairingException
+from sass.db_grabber import get_conn, metadata, partitioned, touch, transaction
+from sass.pairing import (
+    PairingContext,
+    anytime_match,
+    build_cost_matrices,
+    match_players,
+)
+from sass.matching import get_matcher
+from sass.meta import save_summary, summary_rows
+from sass.standings import apply_result, apply_results, update_standings
+from sass.instrumentation import instrumented
 import decimal
+from flask import current_app
 
+ROUND_PAIRED = "SELECT 1 FROM match WHERE tid = :tid AND rnd = :rnd LIMIT 1"
 
+UNREPORTED_MATCHES = "SELECT * FROM match WHERE tid = :tid AND rnd = :rnd AND corp_score IS NULL"
+
+
+def lock_pairing(conn, tid, rnd):
+    """
+    Raises PairingException if the round already has matches, conn being the
+    write transaction that is about to add some. The transaction holds the
+    SQLite write lock, on Postgres the tournament's player rows are locked so
+    two pairings of the same round queue up behind each other.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT id FROM player WHERE tid = :tid FOR UPDATE"), {"tid": tid})
+    check_unpaired(conn, tid, rnd)
+
+
+def check_unpaired(conn, tid, rnd):
+    paired = conn.execute(text(ROUND_PAIRED), {"tid": tid, "rnd": rnd}).fetchone()
+    if paired is not None:
+        raise PairingException(f"Round {rnd} is already paired")
+
+
+@instrumented("pair_round")
 def pair_round(tid, rnd):
-    plrs = get_active_players(tid)
-    if len(plrs) % 2 == 1:
-        plrs = add_bye_player(tid)
-    pairings = make_pairings(plrs)
-    match_list = make_matches(pairings)
-    db = get_db()
+    check_unpaired(get_conn(tid), tid, rnd)
+    ctx = PairingContext.load(tid)
+    if len(ctx.plrs) % 2 == 1:
+        add_bye_player(tid)
+        ctx = PairingContext.load(tid)
+    pairings, report = make_pairings(
+        ctx,
+        current_app.config.get("PAIRING_SCORE_WINDOW"),
+        get_matcher(current_app.config.get("PAIRING_MATCHER", "blossom")),
+        current_app.config.get("PAIRING_TIME_BUDGET"),
+    )
+    match_list = make_matches(pairings, ctx)
     table_match = metadata.tables["match"]
-    with db.begin() as conn:
-        for i, match in enumerate(match_list):
+    with transaction(tid) as conn:
+        lock_pairing(conn, tid, rnd)
+        if match_list:
             conn.execute(
-                insert(table_match).values(
-                    corp_id=match[0],
-                    runner_id=match[1],
-                    tid=tid,
-                    rnd=rnd,
-                    match_num=i + 1,
-                )
+                insert(table_match),
+                [
+                    {
+                        "corp_id": match[0],
+                        "runner_id": match[1],
+                        "tid": tid,
+                        "rnd": rnd,
+                        "match_num": i + 1,
+                    }
+                    for i, match in enumerate(match_list)
+                ],
             )
     score_byes(tid, rnd)
+    current_app.logger.info(
+        f"Paired tournament {tid} round {rnd}: cost {report['cost']}, exact {report['exact']}, "
+        f"forced {report['forced']}"
+    )
+    return report
 
 
 def add_bye_player(tid):
     """
-    Adds a bye player- the bye_number is future proofing for multiple 1st round byes
+    Adds a bye player- the bye_number is future proofing for multiple 1st round byes.
+    Does nothing if the active players are already even, e.g. when another
+    pairing of the round added the bye first.
     """
-    with get_db().begin() as conn:
-        conn.execute(
-            text(
-                "INSERT INTO player (tid, p_name, is_bye, score) VALUES (:tid, 'Bye', true, -9)"
-            ),
+    with transaction(tid) as conn:
+        count = conn.execute(
+            text("SELECT COUNT(*) AS players FROM player WHERE tid = :tid AND active = true"),
             {"tid": tid},
-        )
+        ).fetchone()
+        if count["players"] % 2 == 1:
+            conn.execute(
+                text(
+                    "INSERT INTO player (tid, p_name, is_bye, score) VALUES (:tid, 'Bye', true, -9)"
+                ),
+                {"tid": tid},
+            )
     return get_active_players(tid)
 
 
-def make_pairings(plrs):
-    graph = Graph()
-    plr_ids = [plr["id"] for plr in plrs]
-    for pid in plr_ids:
-        graph.add_node(pid)
-    for pair in combinations(plr_ids, 2):
-        p1 = get_player(pair[0])
-        p2 = get_player(pair[1])
-        corp_player_id, runner_player_id, side_bias_cost = get_side_tuple(p1, p2)
-        if side_bias_cost is None:
-            # print(f"{p1.p_name} v. {p2.p_name} cannot play")
-            continue
-        score_cost = calc_score_cost(p1["score"], p2["score"])
-        # print(f"{p1.p_name} v. {p2.p_name}: {side_bias_cost+score_cost}")
-        graph.add_edge(
-            p1,
-            p2,
-            weight=1000 - (side_bias_cost + score_cost),
-            corp_player=corp_player_id,
-            runner_player=runner_player_id,
-        )
-    pairings = max_weight_matching(graph, maxcardinality=True)
+def make_pairings(ctx, window=None, matcher=None, budget=None):
+    """
+    Edge weights come from build_cost_matrices, which gives the same weights as
+    running get_side_tuple and calc_score_cost over every pair of players.
+    Returns the pairings and a report with the total pairing cost, whether
+    the matching is exact, and how many pairs had to break the rematch or
+    bye rules to get everyone paired in time (see anytime_match).
+
+    :window: optional score window, see match_players. None uses the full graph.
+    :matcher: sass.matching.Matcher backend, defaults to BlossomMatcher
+    :budget: optional time limit in seconds, see anytime_match
+    """
+    costs = build_cost_matrices(ctx)
+    if budget is None:
+        pairs, exact, forced = match_players(costs, window, matcher), True, 0
+    else:
+        pairs, exact, forced = anytime_match(costs, budget, window, matcher)
     aug_pairings = {}
-    for i, pair in enumerate(pairings):
+    for i, pair in enumerate(pairs):
+        corp_player_id, runner_player_id = costs.sides(*pair)
         aug_pairings[i] = {
-            "corp": graph[pair[0]][pair[1]]["corp_player"],
-            "runner": graph[pair[0]][pair[1]]["runner_player"],
+            "corp": corp_player_id,
+            "runner": runner_player_id,
         }
-    return aug_pairings
+    return aug_pairings, {
+        "cost": round(float(costs.total_cost(pairs)), 2),
+        "exact": exact,
+        "forced": forced,
+    }
 
 
-def get_side_tuple(p1, p2):
+def get_side_tuple(p1, p2, ctx=None):
     """
     Returns the minimum weight edge between two players
     First it checks if either of them is the Bye and if either player is eligible for the bye
@@ -88,6 +146,8 @@ def get_side_tuple(p1, p2):
     If there is a forced matchup it returns that value.
     Otherwise it takes the lower of two costs
     If the costs are the same it flips a coin using random.random()
+
+    :ctx: optional PairingContext, answers the forced matchup check without a query
     """
     if p1["is_bye"] or p2["is_bye"]:
         if p1["received_bye"] or p2["received_bye"]:
@@ -97,7 +157,10 @@ def get_side_tuple(p1, p2):
     p1_corp_cost = calc_corp_cost(p1["bias"], p2["bias"])
     p2_corp_cost = calc_corp_cost(p2["bias"], p1["bias"])
 
-    forced_corp = can_corp(p1, p2)
+    if ctx is None:
+        forced_corp = can_corp(p1, p2)
+    else:
+        forced_corp = ctx.can_corp(p1, p2)
 
     if forced_corp is None:
         return (None, None, None)
@@ -146,30 +209,31 @@ def can_corp(p1, p2):
     Otherwise if they total side balance is 0 (they've played both) return None
     Otherwise return the ID of the player who has to Corp
     """
-    with get_db().begin() as conn:
-        p1_corped_query = conn.execute(
-            text("SELECT * from match where corp_id = :p1_id AND runner_id = :p2_id"),
-            {"p1_id": p1["id"], "p2_id": p2["id"]},
-        ).fetchone()
-        p2_corped_query = conn.execute(
-            text("SELECT * from match where corp_id = :p2_id AND runner_id = :p1_id"),
-            {"p1_id": p1["id"], "p2_id": p2["id"]},
-        ).fetchone()
-
-        if p1_corped_query is None and p2_corped_query is None:
-            return 0
-        elif p1_corped_query is None:
-            return p1["id"]
-        elif p2_corped_query is None:
-            return p2["id"]
-        else:
-            return None
+    conn = get_conn(p1["tid"])
+    p1_corped_query = conn.execute(
+        text("SELECT * from match where corp_id = :p1_id AND runner_id = :p2_id"),
+        {"p1_id": p1["id"], "p2_id": p2["id"]},
+    ).fetchone()
+    p2_corped_query = conn.execute(
+        text("SELECT * from match where corp_id = :p2_id AND runner_id = :p1_id"),
+        {"p1_id": p1["id"], "p2_id": p2["id"]},
+    ).fetchone()
+
+    if p1_corped_query is None and p2_corped_query is None:
+        return 0
+    elif p1_corped_query is None:
+        return p1["id"]
+    elif p2_corped_query is None:
+        return p2["id"]
+    else:
+        return None
 
 
-def make_matches(pairings):
+def make_matches(pairings, ctx):
     for key, pair in pairings.items():
         pairings[key]["score"] = (
-            get_player(pair["corp"])["score"] + get_player(pair["runner"])["score"]
+            ctx.get_player(pair["corp"])["score"]
+            + ctx.get_player(pair["runner"])["score"]
         )
     return [
         (pairings[i]["corp"], pairings[i]["runner"])
@@ -179,39 +243,60 @@ def make_matches(pairings):
     ]
 
 
+@instrumented("close_round")
 def close_round(tid, rnd):
     """
     Check to see if all matches report
+    Then recompute the standings in one pass and write them back in the same
+    transaction that retires the bye and moves the tournament on a round.
+    The result is saved as the round's standings snapshot, unless a later round
+    has been paired since, as the standings would then include its results too.
+    The tournament's meta summary is rebuilt from every closed round, so a
+    round closed again after a correction replaces what it counted before.
     """
-    with get_db().begin() as conn:
-        if not all_reported(tid, rnd):
-            raise PairingException("Not all matches have reported result")
-        update_byes_recieved(tid)
-
+    if not all_reported(tid, rnd):
+        raise PairingException("Not all matches have reported result")
+    t = get_tournament(tid)
+    advance = rnd == t["current_rnd"]
+    snapshot = advance or (
+        rnd == t["current_rnd"] - 1 and existing_pairings(tid, t["current_rnd"]) is None
+    )
+    with transaction(tid) as conn:
+        update_standings(conn, tid)
+        if snapshot:
+            save_standings_snapshot(conn, tid, rnd)
         conn.execute(
             text("UPDATE player SET active=false WHERE is_bye = true AND tid = :tid"),
             {"tid": tid},
         )
-
-    update_scores(tid)
-    update_bias(tid)
-    update_sos(tid)
-    update_esos(tid)
-    t = get_tournament(tid)
-    with get_db().begin() as conn:
-        if rnd == t["current_rnd"]:
-            conn.execute(
-                text("UPDATE tournament SET current_rnd = :rnd WHERE id = :tid"),
-                {
-                    "rnd": rnd + 1,
-                    "tid": tid,
-                },
-            )
+        summary = summary_rows(tid, max(rnd, t["current_rnd"] - 1))
+        if not partitioned():
+            if advance:
+                advance_round(conn, tid, rnd)
+            save_summary(conn, tid, summary)
+    if partitioned():
+        # The tournament list and meta summaries are in another database,
+        # only move the round on once its standings are committed
+        with transaction() as conn:
+            if advance:
+                advance_round(conn, tid, rnd)
+            save_summary(conn, tid, summary)
     return True
 
 
+def advance_round(conn, tid, rnd):
+    conn.execute(
+        text("UPDATE tournament SET current_rnd = :rnd WHERE id = :tid"),
+        {
+            "rnd": rnd + 1,
+            "tid": tid,
+        },
+    )
+    touch(tid)
+
+
 def score_byes(tid, rnd):
-    with get_db().begin() as conn:
+    with transaction(tid) as conn:
         conn.execute(
             text(
                 "UPDATE match SET runner_score = 3, corp_score = 0 FROM player WHERE player.id = match.corp_id AND player.is_bye = true AND match.tid = :tid AND rnd = :rnd"
@@ -224,257 +309,135 @@ def score_byes(tid, rnd):
             ),
             {"tid": tid, "rnd": rnd},
         )
+        byes = conn.execute(
+            text(
+                """
+            SELECT m.corp_id, m.runner_id, m.corp_score, m.runner_score
+            FROM match m
+            INNER JOIN player p
+            ON p.id = m.corp_id OR p.id = m.runner_id
+            WHERE p.is_bye = true AND m.tid = :tid AND m.rnd = :rnd
+            """
+            ),
+            {"tid": tid, "rnd": rnd},
+        ).fetchall()
+        for bye in byes:
+            apply_result(
+                conn,
+                tid,
+                bye["corp_id"],
+                bye["runner_id"],
+                (None, None),
+                (bye["corp_score"], bye["runner_score"]),
+            )
 
 
-def record_result(mid, corp_score, runner_score):
-    db = get_db()
+def record_result(mid, corp_score, runner_score, tid=None):
+    """
+    Saves the result and applies it to the live standings straight away, see apply_result
+    """
     table_match = metadata.tables["match"]
-    with db.begin() as conn:
+    with transaction(tid) as conn:
         match = conn.execute(
             select(table_match).where(table_match.c.id == mid)
         ).fetchone()
-        if get_player(match["corp_id"]).is_bye or get_player(match["runner_id"]).is_bye:
+        if get_player(match["corp_id"], tid).is_bye or get_player(match["runner_id"], tid).is_bye:
             return
         conn.execute(
             update(table_match)
             .where(table_match.c.id == mid)
             .values(corp_score=corp_score, runner_score=runner_score)
         )
+        if tid is None:
+            touch(match["tid"])
+        apply_result(
+            conn,
+            match["tid"],
+            match["corp_id"],
+            match["runner_id"],
+            (match["corp_score"], match["runner_score"]),
+            (corp_score, runner_score),
+        )
 
 
-def update_scores(tid):
-    scores_table = []
-    with get_db().begin() as conn:
-        scores_table = conn.execute(
-            text(
-                """
-            SELECT id, name, SUM(coalesce(corp_points,0)) AS corp_points,
-            SUM(coalesce(runner_points,0)) AS runner_points
-            FROM(
-                SELECT p.id AS id, p.p_name AS name, sum(m.corp_score) AS corp_points, 0 AS runner_points
-                FROM player p
-                INNER JOIN match m on p.id = m.corp_id
-                WHERE p.tid = :tid
-                group by p.id
-                UNION
-                SELECT p.id AS id, p.p_name AS name, 0 AS corp_points, sum(m.runner_score) AS runner_points
-                FROM player p
-                INNER JOIN match m on p.id = m.runner_id
-                WHERE p.tid = :tid
-                group by p.id
-            ) as t
-            group by t.id, t.name
-            """
-            ),
-            {"tid": tid},
-        ).fetchall()
-    with get_db().begin() as conn:
-        for player in scores_table:
-            print(player)
-            conn.execute(
-                text(
-                    "UPDATE player SET score = :score WHERE id = :pid AND is_bye = false",
-                ),
-                {
-                    "score": int(player["corp_points"])
-                    + int(player["runner_points"]),
-                    "pid": player["id"],
-                },
-            )
-    update_bias(tid)
-
-
-def update_bias(tid):
-    with get_db().begin() as conn:
-        bias_table = conn.execute(
-            text(
-                """
-        SELECT id, name, sum(coalesce(corp_games,0)) AS corp_games,
-        sum(coalesce(runner_games,0)) AS runner_games
-            FROM(
-                SELECT p.id AS id, p.p_name AS name, count(m.corp_id) AS corp_games, 0 AS runner_games
-                FROM player p
-                INNER JOIN match m on p.id = m.corp_id
-                INNER JOIN player o ON o.id = m.runner_id
-                WHERE p.tid = :tid AND o.is_bye = false AND p.is_bye = false
-                group by p.id
-                UNION
-                SELECT p.id AS id, p.p_name AS name, 0 AS corp_games, count(m.runner_id) AS runner_games
-                FROM player p
-                INNER JOIN match m on p.id = m.runner_id
-                INNER JOIN player o ON o.id = m.corp_id
-                WHERE p.tid = :tid AND o.is_bye = false AND p.is_bye = false
-                group by p.id
-            ) as t
-        group by t.id, t.name
-        """
-            ),
-            {"tid": tid},
-        ).fetchall()
-        for player in bias_table:
-            conn.execute(
-                text(
-                    "UPDATE player SET bias = :bias, games_played = :games_played WHERE id = :pid"
-                ),
-                {
-                    "bias": player["corp_games"] - player["runner_games"],
-                    "games_played": player["corp_games"] + player["runner_games"],
-                    "pid": player["id"],
-                },
-            )
-
-
-def update_sos(tid):
-    with get_db().begin() as conn:
-        sos_table = conn.execute(
+def results_to_save(conn, tid, rnd, results):
+    """
+    The round's matches by id, and the results that aren't for bye matches.
+    Raises AdminException if any result is for a match outside the round.
+    """
+    matches = {
+        m["id"]: m
+        for m in conn.execute(
             text(
                 """
-            SELECT id, sum(coalesce(score,0)) as total_opp_score,
-            sum(coalesce(opg, 0)) as total_opp_games_played
-            FROM (
-                    select p.id, sum(coalesce(o.games_played,0)) as opg, sum(coalesce(o.score,0)) as score
-                    FROM player p
-                    INNER JOIN match m on p.id = m.runner_id
-                    INNER JOIN player o ON m.corp_id = o.id
-                    where p.tid = :tid AND p.is_bye = false AND o.is_bye = false
-                    group by p.id
-
-                UNION
-                select p.id, sum(coalesce(o.games_played,0)) as opg, sum(coalesce(o.score,0)) as score
-                    FROM player p
-                    INNER JOIN match m on p.id = m.corp_id
-                    INNER JOIN player o ON m.runner_id = o.id
-                    where p.tid = :tid AND p.is_bye = false AND o.is_bye = false
-                    group by p.id) as t
-            group by t.id
-            """
-            ),
-            {"tid": tid},
-        ).fetchall()
-        for player in sos_table:
-            conn.execute(
-                text("UPDATE player SET sos = :sos WHERE id = :pid"),
-                {
-                    "sos": round(
-                        player["total_opp_score"]
-                        / max(player["total_opp_games_played"], 1),
-                        3,
-                    ),
-                    "pid": player["id"],
-                },
-            )
-
-
-def update_esos(tid):
-    with get_db().begin() as conn:
-        sos_table = conn.execute(
-            text(
+                SELECT m.id, m.corp_id, m.runner_id, m.corp_score, m.runner_score,
+                c.is_bye OR r.is_bye AS bye_match
+                FROM match m
+                INNER JOIN player c ON c.id = m.corp_id
+                INNER JOIN player r ON r.id = m.runner_id
+                WHERE m.tid = :tid AND m.rnd = :rnd
                 """
-            SELECT id, sum(coalesce(sos,0)) as total_opp_sos,
-            sum(coalesce(opg, 0)) as total_opp_games_played
-            FROM (
-                    select p.id, sum(coalesce(o.games_played,0)) as opg, sum(coalesce(o.sos,0)) as sos
-                    FROM player p
-                    INNER JOIN match m on p.id = m.runner_id
-                    INNER JOIN player o ON m.corp_id = o.id
-                    where p.tid = :tid AND p.is_bye = false AND o.is_bye = false
-                    group by p.id
-
-                UNION
-                select p.id, sum(coalesce(o.games_played,0)) as opg, sum(coalesce(o.sos,0)) as sos
-                    FROM player p
-                    INNER JOIN match m on p.id = m.corp_id
-                    INNER JOIN player o ON m.runner_id = o.id
-                    where p.tid = :tid AND p.is_bye = false AND o.is_bye = false
-                    group by p.id) as t
-            group by t.id
-            """
             ),
-            {"tid": tid},
-        ).fetchall()
-        for player in sos_table:
-            conn.execute(
-                text("UPDATE player SET esos = :esos WHERE id = :pid"),
-                {
-                    "esos": round(
-                        player["total_opp_sos"]
-                        /max(player["total_opp_games_played"], 1),
-                        4,
-                    ),
-                    "pid": player["id"],
-                },
-            )
-
-
-def get_ids():
-    if not os.path.exists("ids.json"):
-        all_cards = requests.get(
-            "https://netrunnerdb.com/api/2.0/public/cards", timeout=5
+            {"tid": tid, "rnd": rnd},
         )
-        ids = [
-            {
-                "side": card["side_code"],
-                "faction": card["faction_code"],
-                "name": card["title"],
-            }
-            for card in all_cards.json()["data"]
-            if card["type_code"] == "identity"
-        ]
-        with open("ids.json", "w") as f:
-            dump(ids, f)
-    else:
-        ids = []
-        with open("ids.json", "r") as f:
-            ids = load(f)
-    return ids
+    }
+    unknown = sorted(mid for mid in results if mid not in matches)
+    if unknown:
+        raise AdminException(f"Round {rnd} has no match {', '.join(str(mid) for mid in unknown)}")
+    return matches, {mid: score for mid, score in results.items() if not matches[mid]["bye_match"]}
 
 
-def update_byes_recieved(tid):
-    with get_db().begin() as conn:
-        byes = conn.execute(
+def record_results(tid, rnd, results):
+    """
+    Saves many results of one round in one transaction, for a scorekeeper
+    entering a stack of result slips. results is {mid: (corp_score, runner_score)}.
+    Every match has to be in the round, or nothing is saved. Bye matches are
+    left alone, as in record_result. Returns how many results were saved.
+
+    The batch is checked before the write transaction opens, so one with
+    nothing to save doesn't count as a change to the tournament.
+    """
+    matches, to_save = results_to_save(get_conn(tid), tid, rnd, results)
+    if not to_save:
+        return 0
+    with transaction(tid) as conn:
+        # Again inside the write, for the old scores as they are now
+        matches, to_save = results_to_save(conn, tid, rnd, results)
+        conn.execute(
             text(
                 """
-            SELECT p.id 
-            FROM player p
-            INNER JOIN match m
-            ON p.id = m.corp_id
-            INNER JOIN player o
-            ON o.id = m.runner_id
-            WHERE o.is_bye = true AND p.tid = :tid
-            """
-            ),
-            {"tid": tid},
-        ).fetchall()
-        for i in byes:
-            conn.execute(
-                text("UPDATE player SET received_bye = true WHERE id = :pid"),
-                {"pid": i["id"]},
-            )
-        byes = conn.execute(
-            text(
+                UPDATE match SET corp_score = :corp_score, runner_score = :runner_score
+                WHERE id = :mid AND NOT EXISTS (
+                    SELECT 1 FROM player
+                    WHERE player.is_bye = true
+                    AND player.id IN (match.corp_id, match.runner_id)
+                )
                 """
-            SELECT p.id 
-            FROM player p
-            INNER JOIN match m
-            ON p.id = m.runner_id
-            INNER JOIN player o
-            ON o.id = m.corp_id
-            WHERE o.is_bye = true AND p.tid = :tid
-            """
             ),
-            {"tid": tid},
-        ).fetchall()
-        for i in byes:
-            conn.execute(
-                text("UPDATE player SET received_bye = true WHERE id = :pid"),
-                {"pid": i["id"]},
-            )
+            [
+                {"mid": mid, "corp_score": score[0], "runner_score": score[1]}
+                for mid, score in to_save.items()
+            ],
+        )
+        apply_results(
+            conn,
+            tid,
+            [
+                (
+                    matches[mid]["corp_id"],
+                    matches[mid]["runner_id"],
+                    (matches[mid]["corp_score"], matches[mid]["runner_score"]),
+                    score,
+                )
+                for mid, score in to_save.items()
+            ],
+        )
+    return len(to_save)
 
 
 def existing_pairings(tid, rnd):
     q = (
-        get_db()
-        .connect()
+        get_conn(tid)
         .execute(
             text("SELECT * FROM match where tid = :tid and rnd = :rnd"),
             {"tid": tid, "rnd": rnd},
@@ -486,12 +449,9 @@ def existing_pairings(tid, rnd):
 
 def all_reported(tid, rnd):
     q = (
-        get_db()
-        .connect()
+        get_conn(tid)
         .execute(
-            text(
-                "SELECT * FROM match WHERE tid = :tid AND rnd = :rnd AND corp_score IS NULL"
-            ),
+            text(UNREPORTED_MATCHES),
             {"tid": tid, "rnd": rnd},
         )
         .fetchone()